@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# convert ape albums into flac, albums with a cue sheet are split in tracks
+# albums are converted in parallel, mac output is piped into flac so there
+# is no wav file on disk
+#    ape2flac.py -j 8 ~/Music/ape
+# Author: P. Aubert pierreaubert@yahoo.fr
+# Apache 2 License
+# ----------------------------------------------------------------------
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import collections
+import concurrent.futures
+
+opts_parser = argparse.ArgumentParser(
+    description="Convert ape albums into flac files, split them with their cue sheet."
+)
+opts_parser.add_argument(
+    "-j",
+    "--jobs",
+    help="number of albums converted in parallel",
+    type=int,
+    default=os.cpu_count() or 1,
+)
+# see https://monkeysaudio.com/
+opts_parser.add_argument("--mac", help="path to mac", default="/usr/bin/mac")
+opts_parser.add_argument("--flac", help="path to flac", default="flac")
+opts_parser.add_argument("--shnsplit", help="path to shnsplit", default="shnsplit")
+opts_parser.add_argument("--cuetag", help="path to cuetag", default="cuetag")
+opts_parser.add_argument(
+    "paths", help="ape files or directories with ape files", nargs="*", default=["."]
+)
+opts = None
+
+AlbumResult = collections.namedtuple(
+    "AlbumResult", ["ape", "ok", "tracks", "encode", "split", "error"]
+)
+
+
+# albums of the same directory check and move their tracks one at a time
+move_lock = threading.Lock()
+
+
+class ConvertError(Exception):
+    """a tool failed, message has the end of its output"""
+
+
+def find_albums(paths):
+    """ape files in *paths*, directories are not recursed into"""
+    albums = []
+    for path in paths:
+        if os.path.isdir(path):
+            albums += sorted(glob.glob(os.path.join(glob.escape(path), "*.ape")))
+        else:
+            albums.append(path)
+    return albums
+
+
+def tail(log, lines=5):
+    log.seek(0)
+    return b"\n".join(log.read().splitlines()[-lines:]).decode("utf-8", "replace")
+
+
+def encode(ape, flac):
+    """mac decodes *ape* to stdout, flac encodes stdin into *flac*"""
+    with tempfile.TemporaryFile() as log:
+        decoder = subprocess.Popen(
+            [opts.mac, ape, "-", "-d"], stdout=subprocess.PIPE, stderr=log
+        )
+        encoder = subprocess.Popen(
+            [opts.flac, "-s", "-f", "--ignore-chunk-sizes", "-o", flac, "-"],
+            stdin=decoder.stdout,
+            stderr=log,
+        )
+        # encoder owns the pipe now, decoder gets SIGPIPE if encoder dies
+        decoder.stdout.close()
+        encoder.wait()
+        decoder.wait()
+        if decoder.returncode != 0 or encoder.returncode != 0:
+            raise ConvertError(
+                "mac returned {0}, flac returned {1}: {2}".format(
+                    decoder.returncode, encoder.returncode, tail(log)
+                )
+            )
+
+
+def run(cmd):
+    """run *cmd*, raise ConvertError with its output if it fails"""
+    r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if r.returncode != 0:
+        raise ConvertError(
+            "{0} returned {1}: {2}".format(
+                os.path.basename(cmd[0]),
+                r.returncode,
+                r.stdout.decode("utf-8", "replace").strip(),
+            )
+        )
+
+
+def split(flac, cue):
+    """
+    split *flac* with *cue* in a temporary directory, tag the tracks and
+    move them next to the album, return the list of tracks
+    albums converted at the same time don't see each other's tracks
+    existing files are never replaced: if one track is already there, no
+    track is moved
+    """
+    directory = os.path.dirname(os.path.abspath(flac))
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        run([opts.shnsplit, "-t", "%n %t", "-f", cue, "-o", "flac", "-d", tmp, flac])
+        for pregap in glob.glob(os.path.join(glob.escape(tmp), "*pregap.flac")):
+            os.remove(pregap)
+        tracks = sorted(glob.glob(os.path.join(glob.escape(tmp), "[0-9]*.flac")))
+        if len(tracks) == 0:
+            raise ConvertError("shnsplit didn't write any track")
+        run([opts.cuetag, cue] + tracks)
+        targets = [os.path.join(directory, os.path.basename(t)) for t in tracks]
+        with move_lock:
+            existing = [t for t in targets if os.path.exists(t)]
+            if len(existing) > 0:
+                raise ConvertError(
+                    "{0} already exists, tracks not moved".format(
+                        ", ".join(os.path.basename(t) for t in existing)
+                    )
+                )
+            for track, target in zip(tracks, targets):
+                shutil.move(track, target)
+        return targets
+
+
+def convert(ape):
+    """convert one album, never raise"""
+    base = os.path.splitext(ape)[0]
+    flac = base + ".flac"
+    cue = base + ".cue"
+    start = time.perf_counter()
+    encoded = None
+    try:
+        if not os.path.isfile(ape):
+            raise ConvertError("can't find {0}".format(ape))
+        encode(ape, flac)
+        encoded = time.perf_counter()
+        tracks = []
+        if os.path.isfile(cue):
+            tracks = split(flac, cue)
+        end = time.perf_counter()
+        return AlbumResult(ape, True, tracks, encoded - start, end - encoded, None)
+    except (OSError, ConvertError) as e:
+        end = time.perf_counter()
+        if encoded is None:
+            encoded = end
+        return AlbumResult(ape, False, [], encoded - start, end - encoded, str(e))
+
+
+def convert_albums(albums, jobs=1):
+    """yield an AlbumResult for each album, in the order they finish"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(convert, ape) for ape in albums]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def display(result):
+    if result.ok:
+        print(
+            (
+                "OK {0}: {1} tracks, encode {2:.1f}s, split {3:.1f}s".format(
+                    result.ape, len(result.tracks), result.encode, result.split
+                )
+            )
+        )
+    else:
+        print(("KO {0}: {1}".format(result.ape, result.error)))
+
+
+# main
+if __name__ == "__main__":
+
+    opts = opts_parser.parse_args()
+
+    albums = find_albums(opts.paths)
+    if len(albums) == 0:
+        print(("{0} can't find any ape file".format(sys.argv[0])))
+        sys.exit(0)
+
+    start = time.perf_counter()
+    failed = 0
+    for result in convert_albums(albums, max(1, opts.jobs)):
+        display(result)
+        if not result.ok:
+            failed += 1
+    print(
+        (
+            "{0} albums converted, {1} failed in {2:.1f}s".format(
+                len(albums) - failed, failed, time.perf_counter() - start
+            )
+        )
+    )
+    sys.exit(1 if failed > 0 else 0)
@@ -0,0 +1,97 @@
+import os
+import stat
+import tempfile
+import unittest
+import ape2flac
+
+
+def script(path, body):
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + body)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+class ConvertTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bin = os.path.join(self.tmp.name, "bin")
+        self.music = os.path.join(self.tmp.name, "music")
+        os.mkdir(self.bin)
+        os.mkdir(self.music)
+        # fake tools: mac prints the ape on stdout, flac copies stdin
+        mac = script(os.path.join(self.bin, "mac"), 'test "$2" = "-" && cat "$1"\n')
+        flac = script(os.path.join(self.bin, "flac"), 'cat > "$5"\n')
+        shnsplit = script(
+            os.path.join(self.bin, "shnsplit"),
+            'touch "$8/00 pregap.flac" "$8/01 One.flac" "$8/02 Two.flac"\n',
+        )
+        cuetag = script(os.path.join(self.bin, "cuetag"), "exit 0\n")
+        ape2flac.opts = ape2flac.opts_parser.parse_args(
+            ["--mac", mac, "--flac", flac, "--shnsplit", shnsplit, "--cuetag", cuetag]
+        )
+        for album in ["a", "b", "c"]:
+            with open(os.path.join(self.music, album + ".ape"), "w") as f:
+                f.write("audio " + album)
+        with open(os.path.join(self.music, "b.cue"), "w") as f:
+            f.write("cue")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_find(self):
+        albums = ape2flac.find_albums([self.music])
+        self.assertEqual([os.path.basename(a) for a in albums], ["a.ape", "b.ape", "c.ape"])
+
+    def test_pipe(self):
+        ape = os.path.join(self.music, "a.ape")
+        result = ape2flac.convert(ape)
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(result.tracks, [])
+        with open(os.path.join(self.music, "a.flac")) as f:
+            self.assertEqual(f.read(), "audio a")
+        self.assertFalse(os.path.exists(os.path.join(self.music, "a.wav")))
+
+    def test_split(self):
+        result = ape2flac.convert(os.path.join(self.music, "b.ape"))
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(
+            [os.path.basename(t) for t in result.tracks], ["01 One.flac", "02 Two.flac"]
+        )
+        names = sorted(os.listdir(self.music))
+        self.assertNotIn("00 pregap.flac", names)
+        self.assertIn("01 One.flac", names)
+
+    def test_parallel(self):
+        albums = ape2flac.find_albums([self.music])
+        results = list(ape2flac.convert_albums(albums, 3))
+        self.assertEqual(sorted(r.ape for r in results), albums)
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_same_tracks(self):
+        # a and b are split in tracks with the same names
+        with open(os.path.join(self.music, "a.cue"), "w") as f:
+            f.write("cue")
+        albums = ape2flac.find_albums([self.music])
+        results = list(ape2flac.convert_albums(albums, 3))
+        failed = [r for r in results if not r.ok]
+        self.assertEqual(len(failed), 1)
+        self.assertIn("01 One.flac, 02 Two.flac already exists", failed[0].error)
+        # the tracks of the other album are still there
+        split = [r for r in results if r.ok and len(r.tracks) > 0]
+        self.assertEqual(len(split), 1)
+        for track in split[0].tracks:
+            self.assertTrue(os.path.exists(track))
+
+    def test_failure(self):
+        ape2flac.opts.flac = script(os.path.join(self.bin, "broken"), "echo oops >&2; exit 3\n")
+        result = ape2flac.convert(os.path.join(self.music, "a.ape"))
+        self.assertFalse(result.ok)
+        self.assertIn("flac returned 3", result.error)
+        self.assertIn("oops", result.error)
+        result = ape2flac.convert(os.path.join(self.music, "missing.ape"))
+        self.assertFalse(result.ok)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,11 +8,20 @@
 # ----------------------------------------------------------------------
 import os
 import sys
+import time
 import re
-import glob
+import io
+import csv
+import shlex
 import codecs
 import unicodedata
 import argparse
+import functools
+import json
+import hashlib
+import sqlite3
+import collections
+import concurrent.futures
 
 opts_parser = argparse.ArgumentParser(
     description="This script will normalize the name of your collection of comics. \
@@ -22,11 +31,55 @@ opts_parser.add_argument("-f", "--force", help="Rename files", action="store_tru
 opts_parser.add_argument(
     "-d", "--debug", help="add (a lot) of traces", action="store_true"
 )
+opts_parser.add_argument(
+    "-j", "--jobs", help="number of processes parsing names", type=int, default=1
+)
+opts_parser.add_argument(
+    "--cache",
+    help="keep parsed names in this file between runs (outside of directory)",
+    action="store",
+)
+opts_parser.add_argument(
+    "-F",
+    "--format",
+    help="output format of the plan",
+    choices=["echo", "shell", "jsonl", "csv"],
+    default="echo",
+)
+opts_parser.add_argument(
+    "--hash-collisions",
+    help="compare the content of files going to the same name",
+    dest="hash_collisions",
+    action="store_true",
+)
+opts_parser.add_argument(
+    "--journal",
+    help="journal of renames, default is .bdnorm.journal in directory, "
+    "previous ones are kept as .bdnorm.journal.<date>",
+    action="store",
+)
+opts_parser.add_argument(
+    "--resume", help="finish the renames of the journal", action="store_true"
+)
+opts_parser.add_argument(
+    "--undo", help="undo the renames of the journal", action="store_true"
+)
 opts_parser.add_argument("directory", help="Directory where the comics are")
 opts = None
 
+# diagnostics and summaries, sent to stderr when the plan is machine readable
+info = sys.stdout
+
+# version of the parsing rules, change it when the parsers change: the
+# names kept by --cache are parsed again
+RULES_VERSION = 1
+
 # separator, a . is allowed but only if followed by something else
 regsep = r"""[.]?[-_\s]+[.]?"""
+# optional tome prefix: T, V, tome, tomes ...
+regtome = r"""(?:[vVtT](?:ome(?:s)?)?[-_ ]?)?"""
+# a tome number
+regnumber = r"""(?P<number>\d{1,2})"""
 
 # ----------------------------------------------------------------------
 # dict of stopwords
@@ -51,6 +104,15 @@ stopwords_en = ["the", "a", "his", "her", "this", "on"]
 stopwords = set(stopwords_fr + stopwords_en)
 
 
+# size of the memo caches of to_ascii, capitalize and pretty: the same
+# series names come back for each tome
+MEMO_SIZE = 16384
+
+# a non word, split lexemes in pretty
+regnonword = re.compile(r"\W+", re.UNICODE)
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
 def to_ascii(text):
     """
     return text
@@ -59,8 +121,7 @@ def to_ascii(text):
     """
     # b = text.encode('utf-16', 'surrogatepass').decode('ascii', 'ignore')
     # return "".join( chr(x) for x in b)
-    b = unicodedata.normalize("NFKD", text).encode("ascii", "ignore")
-    return "".join(chr(x) for x in b)
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
 
 
 def capitalize_first(text):
@@ -73,6 +134,7 @@ def capitalize_first(text):
     return answer
 
 
+@functools.lru_cache(maxsize=MEMO_SIZE)
 def capitalize(text):
     """capitalize text with exceptions"""
     answer = ""
@@ -85,6 +147,7 @@ def capitalize(text):
     return answer
 
 
+@functools.lru_cache(maxsize=MEMO_SIZE)
 def pretty(text):
     """
     pretty print title/serie
@@ -93,36 +156,35 @@ def pretty(text):
        capitalize first word and all following words if not stopwords
     """
 
-    answer = ""
-    reg = re.compile(r"\W+", re.UNICODE)
-
     # transform to ascii first, the above regexp do not work as
     # i understand it should
-    lexemes = reg.split(to_ascii(text))
+    lexemes = regnonword.split(to_ascii(text))
     # lexemes = reg.split(text)
 
-    if lexemes:
-        answer = capitalize_first(lexemes[0])
-        for i in range(1, len(lexemes)):
-            # if opts.debug: print u'{0} {1}'.format(lexemes[i],
-            #                                   capitalize(lexemes[i]))
-            answer = answer + "." + capitalize(lexemes[i])
-    return answer
+    # split always return at least one lexeme
+    words = [capitalize_first(lexemes[0])]
+    words.extend(capitalize(lexeme) for lexeme in lexemes[1:])
+    return ".".join(words)
+
+
+def memo_info():
+    """hits and misses of the memo caches"""
+    return {f.__name__: f.cache_info() for f in (to_ascii, capitalize, pretty)}
 
 
 class ParserForNumber:
     """
     interface class for all parser
+    parsers are stateless: the regexp is compiled once when the module is
+    loaded and the same instance can be used for all files
+    needs lists the characters the pattern cannot match without, see ParserEngine
     """
 
-    def __init__(self, bdname):
-        self.parsed = ["", "", ""]
-        self.bdname = bdname
-        self.regtome = r"""(?:[vVtT](?:ome(?:s)?)?[-_ ]?)?"""
-        self.regnumber = r"""(?P<number>\d{1,2})"""
+    reg = None
+    needs = ""
 
-    def parse(self):
-        return False, self.parsed
+    def parse(self, bdname):
+        return False, ["", "", ""]
 
 
 class ParseSpecial1(ParserForNumber):
@@ -131,40 +193,44 @@ class ParseSpecial1(ParserForNumber):
            V3 #3 (of 5)
     """
 
-    def parse(self):
-        regspec = r"""
-        V(?P<number>\d+)\s+[#]\d+\s+[(]of\s\d+[)]
-        """
-        reg = re.compile(regspec, re.VERBOSE)
+    regspec = r"""
+    V(?P<number>\d+)\s+[#]\d+\s+[(]of\s\d+[)]
+    """
+    reg = re.compile(regspec, re.VERBOSE)
+    needs = "V0 #("
+
+    def parse(self, bdname):
+        parsed = ["", "", ""]
         # search do not always work because of possible multiple matches
-        split = reg.search(self.bdname)
+        split = self.reg.search(bdname)
         # positive case, we have 1 match only
         if split:
             if len(split.groups()) == 1:
                 # easy case
                 if opts.debug:
-                    print(("opts.debug: {0}".format(split.groups())))
+                    print(("opts.debug: {0}".format(split.groups())), file=info)
                 if opts.debug:
                     print(
                         (
                             "opts.debug: from {0} to {1}".format(
                                 split.start(), split.end()
                             )
-                        )
+                        ),
+                        file=info,
                     )
                 # be careful -1 here because of a leading space
-                self.parsed[0] = self.bdname[0 : split.start() - 1]
-                self.parsed[1] = split.group("number")
-                self.parsed[2] = self.bdname[split.end() :]
-                return True, self.parsed
+                parsed[0] = bdname[0 : split.start() - 1]
+                parsed[1] = split.group("number")
+                parsed[2] = bdname[split.end() :]
+                return True, parsed
             else:
                 # two groups of number or more
                 # to be dealt with later
-                print("ko 2 groups or more in reg Vn #n (of N)")
-                return False, self.parsed
+                print("ko 2 groups or more in reg Vn #n (of N)", file=info)
+                return False, parsed
         if opts.debug:
-            print("opts.debug: ParseSpecial1: split do not match on Vn #n (of N)")
-        return False, self.parsed
+            print("opts.debug: ParseSpecial1: split do not match on Vn #n (of N)", file=info)
+        return False, parsed
 
 
 class ParseSpecial2(ParserForNumber):
@@ -176,40 +242,44 @@ class ParseSpecial2(ParserForNumber):
     by checking first we simplify greatly the main regexp
     """
 
-    def parse(self):
-        regspec = r"""
-        (?P<number>\d+)[#]\d+
-        """
-        reg = re.compile(regsep + regspec + regsep, re.VERBOSE)
-        split = reg.search(self.bdname)
+    regspec = r"""
+    (?P<number>\d+)[#]\d+
+    """
+    reg = re.compile(regsep + regspec + regsep, re.VERBOSE)
+    needs = "0# "
+
+    def parse(self, bdname):
+        parsed = ["", "", ""]
+        split = self.reg.search(bdname)
         # positive case, we have 1 match only
         if split:
             if len(split.groups()) == 1:
                 # easy case
                 if opts.debug:
-                    print(("opts.debug: {0}".format(split.groups())))
+                    print(("opts.debug: {0}".format(split.groups())), file=info)
                 if opts.debug:
                     print(
                         (
                             "opts.debug: from {0} to {1}".format(
                                 split.start(), split.end()
                             )
-                        )
+                        ),
+                        file=info,
                     )
                 # be careful -1 here because of a leading space
-                self.parsed[0] = self.bdname[0 : split.start()]
-                self.parsed[1] = split.group("number")
-                self.parsed[2] = self.bdname[split.end() :]
-                return True, self.parsed
+                parsed[0] = bdname[0 : split.start()]
+                parsed[1] = split.group("number")
+                parsed[2] = bdname[split.end() :]
+                return True, parsed
             else:
                 # two groups of number or more
                 # to be dealt with later
-                print("ko 2 groups or more in reg - N#P -")
-            return False, self.parsed
+                print("ko 2 groups or more in reg - N#P -", file=info)
+            return False, parsed
 
         if opts.debug:
-            print("opts.debug: ParseSpecial2: split do not match on - N#P -")
-        return False, self.parsed
+            print("opts.debug: ParseSpecial2: split do not match on - N#P -", file=info)
+        return False, parsed
 
 
 class ParseSpecialOf(ParserForNumber):
@@ -220,10 +290,13 @@ class ParseSpecialOf(ParserForNumber):
           01 (of 04)
     """
 
-    def parse(self):
-        regspec = r"""(?P<first>\d+)\s[(]?of\s\d+[)]?"""
-        reg = re.compile(regspec, re.IGNORECASE | re.VERBOSE)
-        split = reg.search(self.bdname)
+    regspec = r"""(?P<first>\d+)\s[(]?of\s\d+[)]?"""
+    reg = re.compile(regspec, re.IGNORECASE | re.VERBOSE)
+    needs = "0 "
+
+    def parse(self, bdname):
+        parsed = ["", "", ""]
+        split = self.reg.search(bdname)
         if split:
             l1 = len(split.groups())
             if opts.debug:
@@ -232,7 +305,8 @@ class ParseSpecialOf(ParserForNumber):
                         "opts.debug: ParseSpecialOf: len={0} groups={1}".format(
                             l1, split.groups()
                         )
-                    )
+                    ),
+                    file=info,
                 )
             if l1 == 1:
                 # easy case
@@ -242,28 +316,28 @@ class ParseSpecialOf(ParserForNumber):
                             "opts.debug: ParseSpecialOf: from {0} to {1}".format(
                                 split.start(), split.end()
                             )
-                        )
+                        ),
+                        file=info,
                     )
                 # be careful -1 here because of a leading space
-                self.parsed[0] = (
-                    self.bdname[: split.start() - 1] + self.bdname[split.end() :]
-                )
-                self.parsed[1] = split.group("first")
-                self.parsed[2] = ""
+                parsed[0] = bdname[: split.start() - 1] + bdname[split.end() :]
+                parsed[1] = split.group("first")
+                parsed[2] = ""
                 if opts.debug:
-                    print(("opts.debug: ParseSpecialOf: {0}".format(self.parsed[0])))
-                return True, self.parsed
+                    print(("opts.debug: ParseSpecialOf: {0}".format(parsed[0])), file=info)
+                return True, parsed
             else:
                 # two groups of number or more
                 # to be dealt with later
                 print(
-                    ("ko ParseSpecialOf {0} groups or more in reg - N#P -".format(l1))
+                    ("ko ParseSpecialOf {0} groups or more in reg - N#P -".format(l1)),
+                    file=info,
                 )
-            return False, self.parsed
+            return False, parsed
 
         if opts.debug:
-            print("opts.debug: ParseSpecialOf: split do not match on - N of P -")
-        return False, self.parsed
+            print("opts.debug: ParseSpecialOf: split do not match on - N of P -", file=info)
+        return False, parsed
 
 
 class ParseSpecialHS(ParserForNumber):
@@ -271,34 +345,37 @@ class ParseSpecialHS(ParserForNumber):
     lookup for this special synthax
     """
 
-    def parse(self):
-        reghs = r"""(?:T?)(?P<hs>HS)(\s*(?P<hsn>\d{1,2}))?"""
-        reg = re.compile(regsep + reghs + regsep, re.IGNORECASE | re.VERBOSE)
-        split = reg.search(self.bdname)
+    reghs = r"""(?:T?)(?P<hs>HS)(\s*(?P<hsn>\d{1,2}))?"""
+    reg = re.compile(regsep + reghs + regsep, re.IGNORECASE | re.VERBOSE)
+    needs = " hs"
+
+    def parse(self, bdname):
+        parsed = ["", "", ""]
+        split = self.reg.search(bdname)
         # positive case, we have 1 match only
         if split:
             if len(split.groups()) == 3:
                 # easy case
                 if opts.debug:
-                    print(("opts.debug: {0}".format(split.groups())))
-                self.parsed[0] = self.bdname[0 : split.start()]
+                    print(("opts.debug: {0}".format(split.groups())), file=info)
+                parsed[0] = bdname[0 : split.start()]
                 if split.group("hsn"):
                     if opts.debug:
-                        print(("opts.debug: hsn {0}".format(split.group("hsn"))))
-                    self.parsed[1] = split.group("hs") + split.group("hsn")
+                        print(("opts.debug: hsn {0}".format(split.group("hsn"))), file=info)
+                    parsed[1] = split.group("hs") + split.group("hsn")
                 else:
-                    self.parsed[1] = split.group("hs")
-                self.parsed[2] = self.bdname[split.end() :]
-                return True, self.parsed
+                    parsed[1] = split.group("hs")
+                parsed[2] = bdname[split.end() :]
+                return True, parsed
             else:
                 # two groups of number or more
                 # to be dealt with later
-                print(("ko {0} groups or more in hs".format(len(split.groups()))))
-                return False, self.parsed
+                print(("ko {0} groups or more in hs".format(len(split.groups()))), file=info)
+                return False, parsed
 
         if opts.debug:
-            print("opts.debug: ParseSpecialHS split do not match on - HS n - ")
-        return False, self.parsed
+            print("opts.debug: ParseSpecialHS split do not match on - HS n - ", file=info)
+        return False, parsed
 
 
 class ParseNormalCase(ParserForNumber):
@@ -306,16 +383,18 @@ class ParseNormalCase(ParserForNumber):
     lookup for the normal case
     """
 
-    def parse(self):
-        reg1 = re.compile(regsep + self.regtome + self.regnumber + regsep, re.VERBOSE)
+    reg = re.compile(regsep + regtome + regnumber + regsep, re.VERBOSE)
+    needs = "0 "
 
+    def parse(self, bdname):
+        parsed = ["", "", ""]
         # search do not always work because of possible multiple matches
-        split1 = reg1.search(self.bdname)
+        split1 = self.reg.search(bdname)
 
         # positive case, we have 1 match only
         if split1:
             # check if we have more than one number
-            split11 = reg1.search(self.bdname[split1.end() :])
+            split11 = self.reg.search(bdname[split1.end() :])
             if split11:
                 # aie: difficult to guess which one is the good one, try the longuest one or one with a prefix
                 if opts.debug:
@@ -324,7 +403,8 @@ class ParseNormalCase(ParserForNumber):
                             "opts.debug: ParseNormalCase: 2 matches: ({0}) and ({1})".format(
                                 split1.group(0), split11.group(0)
                             )
-                        )
+                        ),
+                        file=info,
                     )
                 # first look for prefix like Tome+Vol to mark the "good" one
                 # count non digit in splits
@@ -343,7 +423,8 @@ class ParseNormalCase(ParserForNumber):
                             "opts.debug: ParseNormalCase: 2 matches: take the longuest ({0},{1})".format(
                                 c1, c11
                             )
-                        )
+                        ),
+                        file=info,
                     )
                 if c11 > c1:
                     split1 = split11
@@ -351,22 +432,23 @@ class ParseNormalCase(ParserForNumber):
             if len(split1.groups()) == 1:
                 # easy case
                 if opts.debug:
-                    print(("opts.debug: ParseNormalCase: {0}".format(split1.groups())))
-                self.parsed[0] = self.bdname[0 : split1.start()]
-                self.parsed[1] = split1.group("number")
-                self.parsed[2] = self.bdname[split1.end() :]
-                return True, self.parsed
+                    print(("opts.debug: ParseNormalCase: {0}".format(split1.groups())), file=info)
+                parsed[0] = bdname[0 : split1.start()]
+                parsed[1] = split1.group("number")
+                parsed[2] = bdname[split1.end() :]
+                return True, parsed
             else:
                 # two groups of number or more
                 # to be dealt with later
-                print("ko 2 groups or more")
-                return False, self.parsed
+                print("ko 2 groups or more", file=info)
+                return False, parsed
 
         if opts.debug:
             print(
-                "opts.debug: ParseNormalCase: split do not match normal number scheme"
+                "opts.debug: ParseNormalCase: split do not match normal number scheme",
+                file=info,
             )
-        return False, self.parsed
+        return False, parsed
 
 
 class ParseNumberSerieTitle(ParserForNumber):
@@ -374,17 +456,19 @@ class ParseNumberSerieTitle(ParserForNumber):
     lookup for number sep serie sep title
     """
 
-    def parse(self, hint_series=None):
-        # different from \w
-        words = "([A-z][A-z0-9]*)"
-        regserie = r"""(?P<serie>{words}+(\s{words})*)""".format(words=words)
-        regtitle = r"""(?P<title>{words}(\s{words})*)""".format(words=words)
-        reg1 = re.compile(
-            self.regnumber + regsep + regserie + regsep + regtitle + "[.]", re.VERBOSE
-        )
-
+    # different from \w
+    words = "([A-z][A-z0-9]*)"
+    regserie = r"""(?P<serie>{words}+(\s{words})*)""".format(words=words)
+    regtitle = r"""(?P<title>{words}(\s{words})*)""".format(words=words)
+    reg = re.compile(
+        regnumber + regsep + regserie + regsep + regtitle + "[.]", re.VERBOSE
+    )
+    needs = "0 ."
+
+    def parse(self, bdname, hint_series=None):
+        parsed = ["", "", ""]
         # search do not always work because of possible multiple matches
-        split1 = reg1.search(self.bdname)
+        split1 = self.reg.search(bdname)
 
         # positive case, we have 1 match only
         if split1:
@@ -395,7 +479,8 @@ class ParseNumberSerieTitle(ParserForNumber):
                         "opts.debug: ParseNumberSerieTitle: len={0} groups={1}".format(
                             l1, split1.group()
                         )
-                    )
+                    ),
+                    file=info,
                 )
                 for i, n in enumerate(split1.groups()):
                     print(
@@ -403,57 +488,60 @@ class ParseNumberSerieTitle(ParserForNumber):
                             "opts.debug: ParseNumberSerieTitle: i={0} group={1}".format(
                                 i, n
                             )
-                        )
+                        ),
+                        file=info,
                     )
             if len(split1.groups()) == 9:
                 # easy case
-                self.parsed[0] = split1.group("serie")
-                if len(self.parsed[0]) == 1 and self.parsed[0][0] in ("_", "-"):
+                parsed[0] = split1.group("serie")
+                if len(parsed[0]) == 1 and parsed[0][0] in ("_", "-"):
                     # grrr this is another case
                     if opts.debug:
                         print(
                             (
                                 "opts.debug: ParseNumberSerieTitle: failed series cannot be: {0}".format(
-                                    self.parsed[0]
+                                    parsed[0]
                                 )
-                            )
+                            ),
+                            file=info,
                         )
-                    return False, self.parsed
-                self.parsed[1] = split1.group("number")
-                self.parsed[2] = (
-                    split1.group("title") + "." + self.bdname[split1.end() :]
-                )
-                if len(self.parsed[2]) == 1 and self.parsed[2][0] in ("_", "-"):
+                    return False, parsed
+                parsed[1] = split1.group("number")
+                parsed[2] = split1.group("title") + "." + bdname[split1.end() :]
+                if len(parsed[2]) == 1 and parsed[2][0] in ("_", "-"):
                     # grrr this is another case
                     if opts.debug:
                         print(
                             (
                                 "opts.debug: ParseNumberSerieTitle: failed title cannot be: {0}".format(
-                                    self.parsed[2]
+                                    parsed[2]
                                 )
-                            )
+                            ),
+                            file=info,
                         )
-                    return False, self.parsed
+                    return False, parsed
                 if opts.debug:
                     print(
                         (
                             "opts.debug: ParseNumberSerieTitle: serie={0} number={1} title={2}".format(
-                                self.parsed[0], self.parsed[1], self.parsed[2]
+                                parsed[0], parsed[1], parsed[2]
                             )
-                        )
+                        ),
+                        file=info,
                     )
-                return True, self.parsed
+                return True, parsed
             else:
                 # two groups of number or more
                 # to be dealt with later
-                print("ko 2 groups or more")
-                return False, self.parsed
+                print("ko 2 groups or more", file=info)
+                return False, parsed
 
         if opts.debug:
             print(
-                "opts.debug: ParseNumberSerieTitle: split do not match normal number scheme"
+                "opts.debug: ParseNumberSerieTitle: split do not match normal number scheme",
+                file=info,
             )
-        return False, self.parsed
+        return False, parsed
 
 
 class ParseNoSerie(ParserForNumber):
@@ -461,22 +549,25 @@ class ParseNoSerie(ParserForNumber):
     lookup for this special synthax
     """
 
-    def parse(self):
-        # we do not find it: possibly we have no serie
-        reg = re.compile(self.regtome + self.regnumber + regsep, re.VERBOSE)
-        split = reg.search(self.bdname)
+    # we do not find it: possibly we have no serie
+    reg = re.compile(regtome + regnumber + regsep, re.VERBOSE)
+    needs = "0 "
+
+    def parse(self, bdname):
+        parsed = ["", "", ""]
+        split = self.reg.search(bdname)
 
         # no serie
         if split:
             if len(split.groups()) == 1:
-                self.parsed[1] = split.group("number")
-                self.parsed[2] = self.bdname[split.end() :]
-                return True, self.parsed
+                parsed[1] = split.group("number")
+                parsed[2] = bdname[split.end() :]
+                return True, parsed
 
         if opts.debug:
-            print("opts.debug: ParseNoSerie: split do not match no serie")
+            print("opts.debug: ParseNoSerie: split do not match no serie", file=info)
 
-        return False, self.parsed
+        return False, parsed
 
 
 class ParseNoTitle(ParserForNumber):
@@ -484,27 +575,30 @@ class ParseNoTitle(ParserForNumber):
     lookup for this special synthax
     """
 
-    def parse(self):
-        reg3 = re.compile(regsep + self.regtome + self.regnumber, re.VERBOSE)
-        split3 = reg3.search(self.bdname)
+    reg = re.compile(regsep + regtome + regnumber, re.VERBOSE)
+    needs = "0 "
+
+    def parse(self, bdname):
+        parsed = ["", "", ""]
+        split3 = self.reg.search(bdname)
 
         # no title
         if split3:
             l3 = len(split3.groups())
             if l3 == 1:
-                self.parsed[0] = self.bdname[0 : split3.start()]
-                self.parsed[1] = split3.group("number")
-                self.parsed[2] = self.bdname[split3.end() :]
+                parsed[0] = bdname[0 : split3.start()]
+                parsed[1] = split3.group("number")
+                parsed[2] = bdname[split3.end() :]
                 if opts.debug:
-                    print("opts.debug: ParseNoTitle: ok")
-                return True, self.parsed
+                    print("opts.debug: ParseNoTitle: ok", file=info)
+                return True, parsed
             else:
                 if opts.debug:
-                    print(("opts.debug: ParseNoTitle: 1 != {0}".format(l3)))
+                    print(("opts.debug: ParseNoTitle: 1 != {0}".format(l3)), file=info)
 
         if opts.debug:
-            print("opts.debug: ParseNoTitle split do not match on no title")
-        return False, self.parsed
+            print("opts.debug: ParseNoTitle split do not match on no title", file=info)
+        return False, parsed
 
 
 class ParseNumberOnly(ParserForNumber):
@@ -512,80 +606,145 @@ class ParseNumberOnly(ParserForNumber):
     lookup for this special synthax
     """
 
-    def parse(self):
-        reg3 = re.compile(self.regtome + self.regnumber, re.VERBOSE)
-        split3 = reg3.search(self.bdname)
+    reg = re.compile(regtome + regnumber, re.VERBOSE)
+    needs = "0"
+
+    def parse(self, bdname):
+        parsed = ["", "", ""]
+        split3 = self.reg.search(bdname)
 
         # no title
         if split3:
             l3 = len(split3.groups())
             if l3 == 1:
-                self.parsed[0] = self.bdname[0 : split3.start()]
-                self.parsed[1] = split3.group("number")
-                self.parsed[2] = self.bdname[split3.end() :]
+                parsed[0] = bdname[0 : split3.start()]
+                parsed[1] = split3.group("number")
+                parsed[2] = bdname[split3.end() :]
                 if opts.debug:
-                    print("opts.debug: ParseNumberOnly: ok")
-                return True, self.parsed
+                    print("opts.debug: ParseNumberOnly: ok", file=info)
+                return True, parsed
             else:
                 if opts.debug:
-                    print(("opts.debug: ParseNumberOnly: 1 != {0}".format(l3)))
+                    print(("opts.debug: ParseNumberOnly: 1 != {0}".format(l3)), file=info)
 
         if opts.debug:
-            print("opts.debug: ParseNumberOnly: split do not match on no title")
-        return False, self.parsed
+            print("opts.debug: ParseNumberOnly: split do not match on no title", file=info)
+        return False, parsed
 
 
-def normalize_number(bdname):
-    """look for number and return 3 parts before, number, after"""
+# ----------------------------------------------------------------------
+# registry of parsers, instanciated once and shared by all files
+# ----------------------------------------------------------------------
+# "1 of 3" is removed first, the remaining name goes through the cascade
+parser_special_of = ParseSpecialOf()
+
+# the cascade, order matters: first parser to match wins
+parsers_for_number = [
+    # case: n # m
+    ParseSpecial1(),
+    # case: 01#02
+    ParseSpecial2(),
+    # case: HS01
+    ParseSpecialHS(),
+    # normal cases
+    ParseNormalCase(),
+    # try rare pattern longest first
+    ParseNumberSerieTitle(),
+    # miss something?
+    ParseNoTitle(),
+    ParseNoSerie(),
+    ParseNumberOnly(),
+]
+
+
+class ParserEngine:
+    """
+    run a cascade of parsers with a single scan of the name
+    the scan (one str.translate) tells which interesting characters are in
+    the name: digits, separators, #, h, s ... each parser declares in needs
+    the ones its pattern cannot do without, so only parsers which have a
+    chance to match are tried, still in the order of the cascade.
+    the list of candidates only depends on the set of characters found and
+    is computed once per set.
+    """
+
+    # labels used in needs
+    labels = frozenset("0 #V(.hs")
+
+    def __init__(self, parsers):
+        self.parsers = parsers
+        self.candidates = {}
+        # ascii: map to a label or drop, other characters are kept
+        self.table = {}
+        for i in range(128):
+            self.table[i] = self.label(chr(i))
+
+    def label(self, c):
+        """label of character *c* or None"""
+        # same definitions as \d and \s in re
+        if c.isdecimal():
+            return "0"
+        if c in "-_" or c.isspace():
+            return " "
+        # HS is looked up ignoring case, the long s is a s for re
+        if c in "hH":
+            return "h"
+        if c in "sS\u017f":
+            return "s"
+        if c in self.labels:
+            return c
+        return None
+
+    def scan(self, bdname):
+        """return the parsers which may match *bdname*"""
+        chars = frozenset(bdname.translate(self.table))
+        if not chars <= self.labels:
+            # non ascii characters
+            chars = frozenset(self.label(c) for c in chars) - {None}
+        candidates = self.candidates.get(chars)
+        if candidates is None:
+            candidates = tuple(p for p in self.parsers if chars.issuperset(p.needs))
+            self.candidates[chars] = candidates
+        return candidates
+
+    def parse(self, bdname):
+        """return the parser which matches (or None) and 3 parts"""
+        for parser in self.scan(bdname):
+            status, parsed = parser.parse(bdname)
+            if status:
+                return parser, parsed
+        return None, ["", "", ""]
+
+
+# the cascade, with a scan to skip parsers which cannot match
+parser_engine = ParserEngine(parsers_for_number)
+
+
+def match_number(bdname):
+    """
+    look for number and return the parser which found it (or None) and
+    3 parts before, number, after
+    """
     parsed = ["", "", ""]
 
     # try to eliminate some pattern wich complicate things later on
     # case of "1 of 3" at the end
-    status, parsed = ParseSpecialOf(bdname).parse()
+    status, parsed = parser_special_of.parse(bdname)
     if status:
         bdname = parsed[0]
         if opts.debug:
-            print(("opts.debug: normalize_number: reduce bdname to {0}".format(bdname)))
+            print(("opts.debug: normalize_number: reduce bdname to {0}".format(bdname)), file=info)
         # need to continue here, only partial match
 
-    # try to eliminate some pattern wich complicate things later on
-    # case: n # m
-    status, parsed = ParseSpecial1(bdname).parse()
-    if status:
-        return parsed
-    # case: 01#02
-    status, parsed = ParseSpecial2(bdname).parse()
-    if status:
-        return parsed
-    # case: HS01
-    status, parsed = ParseSpecialHS(bdname).parse()
-    if status:
-        return parsed
+    parser, parsed = parser_engine.parse(bdname)
+    if parser is None and opts.debug:
+        print(("ko do not find a number in {0}".format(bdname)), file=info)
+    return parser, parsed
 
-    # normal cases
-    status, parsed = ParseNormalCase(bdname).parse()
-    if status:
-        return parsed
-    # try rare pattern longest first
-    status, parsed = ParseNumberSerieTitle(bdname).parse()
-    if status:
-        return parsed
-    # miss something?
-    status, parsed = ParseNoTitle(bdname).parse()
-    if status:
-        return parsed
-    # miss something?
-    status, parsed = ParseNoSerie(bdname).parse()
-    if status:
-        return parsed
-    # miss something?
-    status, parsed = ParseNumberOnly(bdname).parse()
-    if status:
-        return parsed
 
-    if opts.debug:
-        print(("ko do not find a number in {0}".format(bdname)))
-    return parsed
+def normalize_number(bdname):
+    """look for number and return 3 parts before, number, after"""
+    return match_number(bdname)[1]
 
 
 def normalize_pre_number(text):
@@ -606,7 +765,7 @@ def normalize_pre_number(text):
     if split1:
         end = split1.end()
         # remove some . if any
-        while text[end] in (".", "-", " "):
+        while end < len(text) and text[end] in (".", "-", " "):
             end = end + 1
         parsed[0] = text[end:]
     else:
@@ -623,7 +782,8 @@ def normalize_pre_number(text):
         if l2 == 1 and split2.group("stp").lower() in stopwords:
             if opts.debug:
                 print(
-                    ("debug: normalize_pre_number: group={0}".format(split2.groups()))
+                    ("debug: normalize_pre_number: group={0}".format(split2.groups())),
+                    file=info,
                 )
             # of we have found a stopwords at the (end)
             parsed[0] = split2.group("stp") + " " + parsed[0][: split2.start() - 1]
@@ -662,17 +822,20 @@ def normalize_post_number(text):
                     "opts.debug: normalize_post_number: find author {0}".format(
                         split2.group("author")
                     )
-                )
+                ),
+                file=info,
             )
             print(
-                ("opts.debug: normalize_post_number: parsed0 is {0}".format(parsed[0]))
+                ("opts.debug: normalize_post_number: parsed0 is {0}".format(parsed[0])),
+                file=info,
             )
             print(
                 (
                     "opts.debug: normalize_post_number: split2 is from {0} to {1}".format(
                         split2.start(), split2.end()
                     )
-                )
+                ),
+                file=info,
             )
 
         # if title is empty or it is the only information
@@ -725,85 +888,790 @@ def format_name(s):
     return result
 
 
-def normalize_file(text):
+def parse_file(text):
     """
-    call normalize_file
-    parse input and return a list with the different parts
+    parse input and return a list with the different parts and the name of
+    the rule which found the number
     """
     (dirname, bookname) = os.path.split(text)
 
     if opts.debug:
-        print("--------------------------------------------------")
+        print("--------------------------------------------------", file=info)
     if opts.debug:
-        print(("bookname = {0}".format(bookname)))
+        print(("bookname = {0}".format(bookname)), file=info)
     if opts.debug:
-        print("--------------------------------------------------")
+        print("--------------------------------------------------", file=info)
 
     # first call: trying to get number and split in 3
-    parsed1 = normalize_number(bookname)
+    parser, parsed1 = match_number(bookname)
+    rule = parser.__class__.__name__ if parser else None
     if opts.debug:
         print(
             (
                 "ok parsenumber return [{0}], [{1}], [{2}]".format(
                     parsed1[0], parsed1[1], parsed1[2]
                 )
-            )
+            ),
+            file=info,
         )
 
     parsed2 = normalize_pre_number(parsed1[0])
     if opts.debug:
-        print(("ok parsePreNumber return [{0}]".format(parsed2[0])))
+        print(("ok parsePreNumber return [{0}]".format(parsed2[0])), file=info)
 
     parsed3 = normalize_post_number(parsed1[2])
     if opts.debug:
-        print(("ok parsePostNumber return [{0}], [{1}]".format(parsed3[0], parsed3[1])))
+        print(("ok parsePostNumber return [{0}], [{1}]".format(parsed3[0], parsed3[1])), file=info)
 
     # first is empty for now
     if opts.debug:
-        print(("ok {0} pretty {1}".format(parsed3[0], pretty(parsed3[0]))))
-    return [dirname, pretty(parsed2[0]), parsed1[1], pretty(parsed3[0]), parsed3[1]]
+        print(("ok {0} pretty {1}".format(parsed3[0], pretty(parsed3[0]))), file=info)
+    return (
+        [dirname, pretty(parsed2[0]), parsed1[1], pretty(parsed3[0]), parsed3[1]],
+        rule,
+    )
+
+
+def normalize_file(text):
+    """
+    call normalize_file
+    parse input and return a list with the different parts
+    """
+    return parse_file(text)[0]
+
+
+class PlanCache:
+    """
+    parsed names kept between runs in a sqlite database
+       dirs: path of a directory and its mtime when it was listed
+       entries: content of each directory with the parsed name of files
+    a directory with the same mtime is not listed again and a file already
+    parsed is not parsed again. all is dropped when RULES_VERSION changes.
+    """
+
+    schema = """
+        create table if not exists meta (key text primary key, value text);
+        create table if not exists dirs (path text primary key, mtime integer);
+        create table if not exists entries (
+            dir text, name text, is_dir integer, pos integer, parsed text, rule text,
+            primary key (dir, name)
+        );
+    """
+
+    def __init__(self, path, version=RULES_VERSION):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.schema)
+        row = self.db.execute("select value from meta where key = 'version'").fetchone()
+        if row is None or row[0] != str(version):
+            self.db.execute("delete from dirs")
+            self.db.execute("delete from entries")
+            self.db.execute(
+                "insert or replace into meta values ('version', ?)", (str(version),)
+            )
+        self.hits = 0
+        self.misses = 0
+        self.dirs_unchanged = 0
+        self.dirs_listed = 0
+        # parsed values not yet written
+        self.pending = []
+
+    def load(self, parsed, rule):
+        """cached value of a file: parts after the directory and rule or None"""
+        if parsed is None:
+            return None
+        return json.loads(parsed), rule
+
+    def listing(self, path, mtime):
+        """entries of *path* if its mtime did not change or None"""
+        key = os.path.abspath(path)
+        row = self.db.execute("select mtime from dirs where path = ?", (key,)).fetchone()
+        if row is None or row[0] != mtime:
+            return None
+        self.dirs_unchanged += 1
+        rows = self.db.execute(
+            "select name, is_dir, parsed, rule from entries where dir = ? order by pos",
+            (key,),
+        )
+        return [(name, bool(is_dir), self.load(parsed, rule)) for name, is_dir, parsed, rule in rows]
+
+    def store_listing(self, path, mtime, entries):
+        """
+        replace the entries of *path*, files already known keep their
+        parsed value, return the entries with it
+        """
+        key = os.path.abspath(path)
+        self.dirs_listed += 1
+        old = {}
+        for name, is_dir, parsed, rule in self.db.execute(
+            "select name, is_dir, parsed, rule from entries where dir = ?", (key,)
+        ):
+            old[name] = (bool(is_dir), parsed, rule)
+        names = set(e[0] for e in entries)
+        for name, (is_dir, parsed, rule) in old.items():
+            if is_dir and name not in names:
+                self.forget(os.path.join(key, name))
+        self.db.execute("delete from entries where dir = ?", (key,))
+        rows = []
+        result = []
+        for pos, (name, is_dir, cached) in enumerate(entries):
+            parsed = None
+            rule = None
+            if name in old and not is_dir and not old[name][0]:
+                parsed, rule = old[name][1:]
+            rows.append((key, name, int(is_dir), pos, parsed, rule))
+            result.append((name, is_dir, self.load(parsed, rule)))
+        self.db.executemany("insert into entries values (?, ?, ?, ?, ?, ?)", rows)
+        self.db.execute("insert or replace into dirs values (?, ?)", (key, mtime))
+        return result
+
+    def forget(self, key):
+        """remove directory *key* and everything below"""
+        below = key + "/"
+        for table, column in (("dirs", "path"), ("entries", "dir")):
+            self.db.execute(
+                "delete from {0} where {1} = ? or substr({1}, 1, ?) = ?".format(
+                    table, column
+                ),
+                (key, len(below), below),
+            )
+
+    def store(self, bd, s, rule):
+        """keep the parsed value of file *bd*"""
+        dirname, name = os.path.split(bd)
+        self.misses += 1
+        self.pending.append((json.dumps(s[1:]), rule, os.path.abspath(dirname), name))
+        if len(self.pending) >= 10000:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany(
+            "update entries set parsed = ?, rule = ? where dir = ? and name = ?",
+            self.pending,
+        )
+        self.pending = []
+        self.db.commit()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total > 0 else 0.0
+        return "cache: {0} hits, {1} misses ({2:.1f}% hit rate), {3} directories unchanged, {4} listed".format(
+            self.hits, self.misses, rate, self.dirs_unchanged, self.dirs_listed
+        )
 
 
-def normalize_directory(current):
-    """normalize all files in a directory"""
-    regdir = "{:s}/*".format(current)
-    bdlist = glob.glob(regdir)
-    for bd in bdlist:
-        if os.path.isdir(bd):
-            normalize_directory(bd)
+def list_directory(current, cache=None):
+    """
+    return the visible entries of *current* as (name, is_dir, cached)
+    cached is the value found in *cache* for a file or None
+    """
+    if cache is not None:
+        try:
+            mtime = os.stat(current).st_mtime_ns
+        except OSError:
+            return []
+        entries = cache.listing(current, mtime)
+        if entries is not None:
+            return entries
+    try:
+        with os.scandir(current) as it:
+            # glob ignores hidden files
+            entries = [
+                (entry.name, entry.is_dir(), None)
+                for entry in it
+                if not entry.name.startswith(".")
+            ]
+    except OSError:
+        return []
+    if cache is not None:
+        entries = cache.store_listing(current, mtime, entries)
+    return entries
+
+
+def walk_directory(current, cache=None):
+    """
+    yield (path, cached) for all files under *current*, depth first
+    same files in the same order as glob("{current}/*") and a recursion on
+    each directory, but the type comes from the directory entry, we do not
+    need a stat per file
+    """
+    # same path as glob
+    prefix = os.path.dirname(os.path.join(current, "*"))
+    # read the whole directory first, files may be renamed later on
+    for name, is_dir, cached in list_directory(current, cache):
+        bd = os.path.join(prefix, name)
+        if is_dir:
+            yield from walk_directory(bd, cache)
         else:
-            s = normalize_file(bd)
-            if s:
-                fs = format_name(s)
-                if not fs or len(fs) == 0:
-                    print(("echo KO {0}".format(bd)))
+            yield bd, cached
+
+
+# one line of the rename plan
+#    source: current path
+#    target: proposed path or None
+#    rule: name of the parser which found the number or None
+#    status: keep (name is already fine), move, ko (no proposed name), failed,
+#            collision (target is taken) or duplicate (taken by the same content)
+#    other: for collision and duplicate, the file which has the target
+RenamePlan = collections.namedtuple(
+    "RenamePlan", ["source", "target", "rule", "status", "other"], defaults=[None]
+)
+
+
+def plan_parsed(bd, s, rule):
+    """RenamePlan for *bd* parsed as *s*"""
+    if not s:
+        return RenamePlan(bd, None, rule, "failed")
+    fs = format_name(s)
+    if not fs or len(fs) == 0:
+        return RenamePlan(bd, None, rule, "ko")
+    if fs == bd:
+        return RenamePlan(bd, fs, rule, "keep")
+    return RenamePlan(bd, fs, rule, "move")
+
+
+def plan_entry(entry):
+    """
+    *entry* is (path, cached) as given by walk_directory, return the
+    RenamePlan and what has been parsed (None if it comes from the cache)
+    """
+    bd, cached = entry
+    if cached is not None:
+        parts, rule = cached
+        return plan_parsed(bd, [os.path.split(bd)[0]] + parts, rule), None
+    s, rule = parse_file(bd)
+    return plan_parsed(bd, s, rule), (s, rule)
+
+
+def plan_file(bd):
+    """parse *bd* and return a RenamePlan"""
+    return plan_entry((bd, None))[0]
+
+
+def plan_chunk(chunk):
+    """plan_entry on a list of entries, run by the workers"""
+    return [plan_entry(entry) for entry in chunk]
+
+
+def info_stream(options):
+    """stderr when the plan is machine readable, stdout otherwise"""
+    return sys.stdout if options.format == "echo" else sys.stderr
+
+
+def init_worker(options):
+    """workers need the options of the main process"""
+    global opts, info
+    opts = options
+    info = info_stream(options)
+
+
+def plan_entries(entries, jobs=1, chunksize=256):
+    """
+    yield plan_entry() for all *entries* in the same order
+    with *jobs* > 1 entries are sent by chunks to a pool of processes, only a
+    few chunks are in flight so memory does not grow with the number of files
+    """
+    if jobs <= 1:
+        for entry in entries:
+            yield plan_entry(entry)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        jobs, initializer=init_worker, initargs=(opts,)
+    ) as pool:
+        pending = collections.deque()
+        chunk = []
+        for entry in entries:
+            chunk.append(entry)
+            if len(chunk) == chunksize:
+                pending.append(pool.submit(plan_chunk, chunk))
+                chunk = []
+            if len(pending) > 2 * jobs:
+                yield from pending.popleft().result()
+        if chunk:
+            pending.append(pool.submit(plan_chunk, chunk))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def plan_files(entries, jobs=1, chunksize=256, cache=None):
+    """
+    yield a RenamePlan for all *entries* given by walk_directory
+    what has been parsed is kept in *cache*
+    """
+    for plan, parsed in plan_entries(entries, jobs, chunksize):
+        if cache is not None:
+            if parsed is None:
+                cache.hits += 1
+            else:
+                cache.store(plan.source, *parsed)
+        yield plan
+
+
+def file_digest(path, chunksize=1 << 20):
+    """sha256 of the content of *path*, read by chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunksize), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def same_content(path1, path2):
+    """true if both files have the same content"""
+    try:
+        if os.path.getsize(path1) != os.path.getsize(path2):
+            return False
+        return file_digest(path1) == file_digest(path2)
+    except OSError:
+        return False
+
+
+class TargetIndex:
+    """
+    index of the targets of the plan and of the files already in the target
+    directories, tell in O(1) if a file is going to overwrite another one
+    """
+
+    def __init__(self, hash_collisions=False):
+        # target -> source planned to go there
+        self.targets = {}
+        # directory -> names of the files in it, read once
+        self.dirs = {}
+        # compare the content of colliding files
+        self.hash_collisions = hash_collisions
+
+    def existing(self, directory):
+        """names in *directory*"""
+        names = self.dirs.get(directory)
+        if names is None:
+            try:
+                with os.scandir(directory or ".") as it:
+                    names = set(entry.name for entry in it)
+            except OSError:
+                names = set()
+            self.dirs[directory] = names
+        return names
+
+    def check(self, plan):
+        """return *plan* with a collision or duplicate status if needed"""
+        if plan.status == "keep":
+            self.targets.setdefault(plan.target, plan.source)
+            return plan
+        if plan.status != "move":
+            return plan
+        other = self.targets.get(plan.target)
+        if other is None:
+            directory, name = os.path.split(plan.target)
+            if name in self.existing(directory):
+                other = plan.target
+        if other is None:
+            self.targets[plan.target] = plan.source
+            return plan
+        status = "collision"
+        if self.hash_collisions and same_content(plan.source, other):
+            status = "duplicate"
+        return plan._replace(status=status, other=other)
+
+
+def iter_rename_plan(root, jobs=1, cache=None, index=None):
+    """
+    yield a RenamePlan for each file under *root*, lazily while the tree is
+    walked, memory does not depend on the number of files
+    with a TargetIndex, files going to an existing name are reported
+    """
+    global opts
+    if opts is None:
+        # used as a library: default options
+        opts = opts_parser.parse_args([root])
+    plans = plan_files(walk_directory(root, cache), jobs, cache=cache)
+    if index is not None:
+        plans = map(index.check, plans)
+    return plans
+
+
+class PlanWriter:
+    """
+    interface class for all output formats of the plan
+    lines are kept and written by blocks, not one write per file
+    """
+
+    def __init__(self, out=None, bufsize=1024):
+        self.out = out if out is not None else sys.stdout
+        self.bufsize = bufsize
+        self.lines = []
+
+    def format(self, plan):
+        """text for *plan* or None"""
+        return None
+
+    def write(self, plan):
+        line = self.format(plan)
+        if line is not None:
+            self.lines.append(line)
+            if len(self.lines) >= self.bufsize:
+                self.flush()
+
+    def flush(self):
+        self.out.write("".join(self.lines))
+        self.out.flush()
+        self.lines = []
+
+    def close(self):
+        self.flush()
+
+
+class EchoWriter(PlanWriter):
+    """historical output: echo OK ... moved to ..."""
+
+    def format(self, plan):
+        if plan.status == "failed":
+            return "normalize_file failed for {0}\n".format(plan.source)
+        elif plan.status == "ko":
+            return "echo KO {0}\n".format(plan.source)
+        elif plan.status == "collision":
+            return "echo KO {0} collides with {1}\n".format(plan.source, plan.other)
+        elif plan.status == "duplicate":
+            return "echo KO {0} duplicate of {1}\n".format(plan.source, plan.other)
+        elif plan.status == "keep":
+            if opts.debug:
+                return "echo OK {0}\n".format(plan.source)
+            return None
+        return "echo OK {0} moved to {1}\n".format(plan.source, plan.target)
+
+
+class ShellWriter(PlanWriter):
+    """a shell script doing the renames, names are quoted"""
+
+    def __init__(self, out=None, bufsize=1024):
+        super(ShellWriter, self).__init__(out, bufsize)
+        self.lines.append("#!/bin/sh\n")
+        # directories created by the script
+        self.dirs = set()
+
+    def format(self, plan):
+        if plan.status == "keep":
+            return None
+        if plan.status != "move":
+            # a comment, no newline can break out of it
+            return "# {0} {1}\n".format(
+                plan.status.upper(), shlex.quote(plan.source).replace("\n", "?")
+            )
+        line = ""
+        directory = os.path.dirname(plan.target)
+        if directory and directory != os.path.dirname(plan.source):
+            if directory not in self.dirs:
+                self.dirs.add(directory)
+                line = "mkdir -p -- {0}\n".format(shlex.quote(directory))
+        return line + "mv -n -- {0} {1}\n".format(
+            shlex.quote(plan.source), shlex.quote(plan.target)
+        )
+
+
+class JsonWriter(PlanWriter):
+    """one json object per line"""
+
+    def format(self, plan):
+        return json.dumps(plan._asdict()) + "\n"
+
+
+class CsvWriter(PlanWriter):
+    """csv with a header line"""
+
+    def __init__(self, out=None, bufsize=1024):
+        super(CsvWriter, self).__init__(out, bufsize)
+        self.csv = io.StringIO()
+        self.writer = csv.writer(self.csv)
+        self.lines.append(self.row(RenamePlan._fields))
+
+    def row(self, values):
+        self.writer.writerow(values)
+        line = self.csv.getvalue()
+        self.csv.seek(0)
+        self.csv.truncate()
+        return line
+
+    def format(self, plan):
+        return self.row(plan)
+
+
+plan_writers = {
+    "echo": EchoWriter,
+    "shell": ShellWriter,
+    "jsonl": JsonWriter,
+    "csv": CsvWriter,
+}
+
+
+def normalize_directory(current, jobs=1, cache=None, writer=None):
+    """
+    normalize all files in a directory
+    with --force, return the list of files to move
+    """
+    if writer is None:
+        writer = EchoWriter()
+    moves = []
+    index = TargetIndex(opts.hash_collisions)
+    try:
+        for plan in iter_rename_plan(current, jobs, cache, index):
+            writer.write(plan)
+            if plan.status == "move" and opts.force:
+                moves.append(plan)
+    finally:
+        writer.flush()
+    return moves
+
+
+# ----------------------------------------------------------------------
+# journal of renames
+# one json object per line:
+#    {"source": ..., "target": ..., "file": [inode, size]}
+#                                    a move, numbered by order of appearance
+#    {"done": n}                     move n has been done
+#    {"undone": n}                   move n has been undone
+# ----------------------------------------------------------------------
+def write_journal(path, moves):
+    """
+    write the plan of *moves* in a new journal, paths are absolute so the
+    journal can be resumed or undone from any directory
+    """
+    with open(path, "w", encoding="utf-8") as journal:
+        for plan in moves:
+            record = {
+                "source": os.path.abspath(plan.source),
+                "target": os.path.abspath(plan.target),
+                "file": file_identity(plan.source),
+            }
+            journal.write(json.dumps(record))
+            journal.write("\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def file_identity(path):
+    """[inode, size] of *path*, both are kept by a rename, None if unknown"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_size]
+
+
+def is_moved_file(path, identity):
+    """*path* is the file of the journal, journals without identity trust it"""
+    return identity is None or file_identity(path) == identity
+
+
+def other_file_exists(path, other):
+    """*other* exists and is not *path* (a case change is the same file)"""
+    if not os.path.exists(other):
+        return False
+    try:
+        return not os.path.samefile(path, other)
+    except OSError:
+        return True
+
+
+def read_journal(path):
+    """return the list of (source, target, identity) and the set of moves done"""
+    moves = []
+    done = set()
+    with open(path, encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # last line may be truncated by a crash
+                continue
+            if "source" in record:
+                moves.append((record["source"], record["target"], record.get("file")))
+            elif "done" in record:
+                done.add(record["done"])
+            elif "undone" in record:
+                done.discard(record["undone"])
+    return moves, done
+
+
+def rotate_journal(path):
+    """
+    keep the journal of a previous run as path.<date>, it can still be
+    undone with --journal. return the new name or None if there is none
+    """
+    if not os.path.exists(path):
+        return None
+    rotated = "{0}.{1}".format(path, time.strftime("%Y%m%d-%H%M%S"))
+    count = 1
+    while os.path.exists(rotated):
+        count += 1
+        rotated = "{0}.{1}-{2}".format(path, time.strftime("%Y%m%d-%H%M%S"), count)
+    os.rename(path, rotated)
+    return rotated
+
+
+def group_by_directory(moves, indexes):
+    """*indexes* of *moves* grouped by target directory"""
+    groups = collections.OrderedDict()
+    for i in indexes:
+        groups.setdefault(os.path.dirname(moves[i][1]), []).append(i)
+    return groups
+
+
+def execute_journal(path):
+    """
+    do all moves of the journal which are not done yet, directory by
+    directory; each move is marked done in the journal once renamed so a
+    crash can be resumed. return (number of moves done, number of errors)
+    """
+    moves, done = read_journal(path)
+    todo = [i for i in range(len(moves)) if i not in done]
+    cnt_done = 0
+    cnt_errors = 0
+    with open(path, "a", encoding="utf-8") as journal:
+        for directory, indexes in group_by_directory(moves, todo).items():
+            if directory:
+                try:
+                    os.makedirs(directory, exist_ok=True)
+                except OSError as e:
+                    print(("echo KO {0} not created: {1}".format(directory, e)), file=info)
+                    cnt_errors += len(indexes)
+                    continue
+            for i in indexes:
+                source, target, identity = moves[i]
+                if not os.path.exists(source) and os.path.exists(target):
+                    if not is_moved_file(target, identity):
+                        print(
+                            ("echo KO {0} not moved: {1} is another file".format(source, target)),
+                            file=info,
+                        )
+                        cnt_errors += 1
+                        continue
+                    # renamed before a crash, not yet marked
+                elif other_file_exists(source, target):
+                    # created since the plan, never replace it
+                    print(("echo KO {0} not moved: {1} exists".format(source, target)), file=info)
+                    cnt_errors += 1
                     continue
-                if fs == bd:
-                    if opts.debug:
-                        print(("echo OK {0}".format(bd)))
                 else:
-                    print(("echo OK {0} moved to {1}".format(bd, fs)))
-                    if opts.force:
-                        os.rename(bd, fs)
+                    try:
+                        os.rename(source, target)
+                    except OSError as e:
+                        print(("echo KO {0} not moved: {1}".format(source, e)), file=info)
+                        cnt_errors += 1
+                        continue
+                if opts.debug:
+                    print(("moved {0} to {1}".format(source, target)), file=info)
+                journal.write(json.dumps({"done": i}))
+                journal.write("\n")
+                journal.flush()
+                cnt_done += 1
+            os.fsync(journal.fileno())
+    return cnt_done, cnt_errors
+
+
+def undo_journal(path):
+    """
+    move back all files of the journal which have been moved, last one
+    first. return (number of moves undone, number of errors)
+    """
+    moves, done = read_journal(path)
+    cnt_undone = 0
+    cnt_errors = 0
+    with open(path, "a", encoding="utf-8") as journal:
+        for i in sorted(done, reverse=True):
+            source, target, identity = moves[i]
+            if not os.path.exists(target) and os.path.exists(source):
+                # undone before a crash, not yet marked
+                pass
+            elif other_file_exists(target, source):
+                print(("echo KO {0} not moved back: {1} exists".format(target, source)), file=info)
+                cnt_errors += 1
+                continue
+            elif os.path.exists(target) and not is_moved_file(target, identity):
+                # replaced since the move, it is not ours to rename
+                print(
+                    ("echo KO {0} not moved back: it is another file".format(target)),
+                    file=info,
+                )
+                cnt_errors += 1
+                continue
             else:
-                print(("normalize_file failed for {0}".format(bd)))
+                try:
+                    os.rename(target, source)
+                except OSError as e:
+                    print(("echo KO {0} not moved back: {1}".format(target, e)), file=info)
+                    cnt_errors += 1
+                    continue
+            if opts.debug:
+                print(("moved back {0} to {1}".format(target, source)), file=info)
+            journal.write(json.dumps({"undone": i}))
+            journal.write("\n")
+            journal.flush()
+            cnt_undone += 1
+        os.fsync(journal.fileno())
+    return cnt_undone, cnt_errors
 
 
 # main
 if __name__ == "__main__":
 
     opts = opts_parser.parse_args()
+    info = info_stream(opts)
 
     # some traces
     if opts.debug:
-        print(stopwords)
+        print(stopwords, file=info)
 
     # be careful with the locale
     # locale.setlocale(locale.LC_CTYPE,"fr_FR.UTF8")
 
+    journal = opts.journal
+    if journal is None:
+        # hidden: not seen by the walk
+        journal = os.path.join(opts.directory, ".bdnorm.journal")
+
+    if opts.resume or opts.undo:
+        if not os.path.isfile(journal):
+            print(("{0} is not a journal".format(journal)))
+            sys.exit(1)
+        if opts.undo:
+            cnt, cnt_errors = undo_journal(journal)
+            print(("{0} files moved back, {1} errors".format(cnt, cnt_errors)))
+        else:
+            cnt, cnt_errors = execute_journal(journal)
+            print(("{0} files moved, {1} errors".format(cnt, cnt_errors)))
+        sys.exit(1 if cnt_errors > 0 else 0)
+
     if os.path.isdir(opts.directory):
-        # scan all files under dir, need to use a unicode regexp for glob
-        normalize_directory(opts.directory)
+        # scan all files under dir
+        cache = None
+        if opts.cache:
+            cache = PlanCache(opts.cache)
+        try:
+            writer = plan_writers[opts.format]()
+            moves = normalize_directory(opts.directory, opts.jobs, cache, writer)
+        finally:
+            if cache is not None:
+                cache.close()
+                print(cache.stats(), file=sys.stderr)
+            if opts.debug:
+                for name, memo in memo_info().items():
+                    print(("memo {0}: {1}".format(name, memo)), file=sys.stderr)
+        if opts.force:
+            # plan first, then rename in bulk
+            cnt, cnt_errors = 0, 0
+            if len(moves) > 0:
+                # the journal of the previous run is kept, not overwritten
+                rotated = rotate_journal(journal)
+                if rotated is not None:
+                    print(("previous journal kept as {0}".format(rotated)), file=info)
+                write_journal(journal, moves)
+                cnt, cnt_errors = execute_journal(journal)
+            print(("{0} files moved, {1} errors".format(cnt, cnt_errors)), file=info)
+            if cnt_errors > 0:
+                sys.exit(1)
     else:
         print(("{0} is not a directory".format(opts.directory)))
         sys.exit(1)
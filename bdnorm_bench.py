@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# benchmark for bdnorm
+# generate a synthetic corpus of comics names from the examples of the
+# testsuite and measure how many files per second bdnorm can normalize
+# results can be saved and compared between commits:
+#    python bdnorm_bench.py -n 10000 100000 -o bench.jsonl
+#    ... change something ...
+#    python bdnorm_bench.py -n 10000 100000 --compare bench.jsonl
+# Author: P. Aubert pierreaubert@yahoo.fr
+# Apache 2 License
+# ----------------------------------------------------------------------
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import collections
+
+import bdnorm
+import bdnorm_test
+
+opts_parser = argparse.ArgumentParser(
+    description="Measure the throughput of bdnorm on a synthetic corpus of names."
+)
+opts_parser.add_argument(
+    "-n",
+    "--size",
+    help="number of names in the corpus, can be repeated",
+    type=int,
+    nargs="+",
+    default=[100000],
+)
+opts_parser.add_argument(
+    "-r", "--repeat", help="number of runs, best one is kept", type=int, default=3
+)
+opts_parser.add_argument(
+    "-s", "--seed", help="seed for the corpus generator", type=int, default=1
+)
+opts_parser.add_argument(
+    "-S",
+    "--sets",
+    help="examples of the testsuite used as models",
+    nargs="+",
+    choices=["base", "without_series", "real_life", "debug", "next"],
+    default=["base", "without_series", "real_life", "debug"],
+)
+opts_parser.add_argument(
+    "-o", "--output", help="append results to this file (json lines)", action="store"
+)
+opts_parser.add_argument(
+    "--compare", help="compare with results saved in this file", action="store"
+)
+opts = None
+
+# words we do not want to replace since the parsers rely on them
+keepwords = set(["tome", "tomes", "of", "pdf", "cbz", "cbr", "zip", "rar", "bd", "fr"])
+
+# a word long enough to be a piece of a serie or of a title
+regword = re.compile(r"[A-Za-z]{3,}")
+
+
+def samples(sets=("base", "without_series", "real_life", "debug")):
+    """all names used in the testsuite for these *sets*"""
+    datas = []
+    for name in sets:
+        datas += getattr(bdnorm_test, "datas_" + name)
+    return [d[0] for d in datas]
+
+
+def synthetic_corpus(size, seed=1, sets=("base", "without_series", "real_life", "debug")):
+    """
+    build *size* names with the same shapes as the examples of the testsuite
+    words of series and titles are replaced by random ones, numbers and
+    separators are kept
+    """
+    rnd = random.Random(seed)
+    models = samples(sets)
+    vocabulary = sorted(
+        set(
+            w.lower()
+            for m in models
+            for w in regword.findall(m)
+            if w.lower() not in keepwords
+        )
+    )
+
+    def replace(match):
+        word = match.group(0)
+        if word.lower() in keepwords:
+            return word
+        new = rnd.choice(vocabulary)
+        if word == word.upper():
+            return new.upper()
+        if word[0] == word[0].upper():
+            return new.title()
+        return new
+
+    return [regword.sub(replace, rnd.choice(models)) for _ in range(size)]
+
+
+def clear_memo():
+    """each run starts with empty memo caches"""
+    for f in (bdnorm.to_ascii, bdnorm.capitalize, bdnorm.pretty):
+        f.cache_clear()
+
+
+def run(corpus):
+    """normalize all names in *corpus* and return the elapsed time"""
+    clear_memo()
+    start = time.perf_counter()
+    for name in corpus:
+        bdnorm.format_name(bdnorm.normalize_file(name))
+    return time.perf_counter() - start
+
+
+def hits(corpus):
+    """number of names found by each parser"""
+    counter = collections.Counter()
+    for name in corpus:
+        s, rule = bdnorm.parse_file(name)
+        counter[rule or "none"] += 1
+    return dict(counter)
+
+
+def peak_memory(corpus):
+    """peak of memory allocated while normalizing *corpus* (bytes)"""
+    clear_memo()
+    tracemalloc.start()
+    for name in corpus:
+        bdnorm.format_name(bdnorm.normalize_file(name))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def commit():
+    """current git commit or None"""
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+            or None
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench(size, repeat=3, seed=1, sets=("base", "without_series", "real_life", "debug")):
+    """return a dict with the results for a corpus of *size* names"""
+    corpus = synthetic_corpus(size, seed, sets)
+    best = min(run(corpus) for _ in range(repeat))
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "size": size,
+        "seed": seed,
+        "sets": sorted(sets),
+        "time": best,
+        "speed": size / best,
+        "peak_memory": peak_memory(corpus),
+        "hits": hits(corpus),
+    }
+
+
+def same_bench(a, b):
+    return a["size"] == b["size"] and a["seed"] == b["seed"] and a["sets"] == b["sets"]
+
+
+def load_results(path):
+    """results saved by --output"""
+    results = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                results.append(json.loads(line))
+    return results
+
+
+def display(result, previous=None):
+    print(
+        (
+            "bdnorm: {0} names in {1:.2f}s, {2:.0f} files/s, peak memory {3:.1f} MiB".format(
+                result["size"],
+                result["time"],
+                result["speed"],
+                result["peak_memory"] / (1024 * 1024),
+            )
+        )
+    )
+    if previous is not None:
+        print(
+            (
+                "    vs {0}: {1:.0f} files/s, x{2:.2f}".format(
+                    previous["commit"],
+                    previous["speed"],
+                    result["speed"] / previous["speed"],
+                )
+            )
+        )
+    for rule, count in sorted(result["hits"].items(), key=lambda a: -a[1]):
+        print(("    {0:<24s} {1:>8d}".format(rule, count)))
+
+
+# main
+if __name__ == "__main__":
+
+    opts = opts_parser.parse_args()
+
+    bdnorm.opts = bdnorm.opts_parser.parse_args(["."])
+
+    saved = []
+    if opts.compare:
+        saved = load_results(opts.compare)
+
+    for size in opts.size:
+        result = bench(size, opts.repeat, opts.seed, opts.sets)
+        previous = None
+        for r in saved:
+            if same_bench(r, result):
+                previous = r
+        display(result, previous)
+        if opts.output:
+            with open(opts.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
+
+    sys.exit(0)
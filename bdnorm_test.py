@@ -5,6 +5,13 @@
 #    series/Series_01_Title.suf
 # ----------------------------------------------------------------------
 
+import io
+import os
+import csv
+import json
+import glob
+import tempfile
+import subprocess
 import unittest
 import bdnorm
 
@@ -268,5 +275,322 @@ class NormalizeTests(unittest.TestCase):
         self._run_all(datas_debug)
 
 
+class ParserRegistryTests(unittest.TestCase):
+    """parsers are shared between files"""
+
+    def setUp(self):
+        bdnorm.opts = bdnorm.opts_parser.parse_args(["dir"])
+
+    def test_stateless(self):
+        parser = bdnorm.ParseNormalCase()
+        status1, parsed1 = parser.parse("series_12_title.pdf")
+        status2, parsed2 = parser.parse("other 03 book.cbz")
+        self.assertTrue(status1)
+        self.assertTrue(status2)
+        self.assertEqual(parsed1, ["series", "12", "title.pdf"])
+        self.assertEqual(parsed2, ["other", "03", "book.cbz"])
+
+    def test_registry_order(self):
+        names = [p.__class__.__name__ for p in bdnorm.parsers_for_number]
+        self.assertEqual(names[0], "ParseSpecial1")
+        self.assertEqual(names[-1], "ParseNumberOnly")
+
+
+class ParserEngineTests(unittest.TestCase):
+    """the engine must give the same answer as the cascade"""
+
+    def setUp(self):
+        bdnorm.opts = bdnorm.opts_parser.parse_args(["dir"])
+
+    def _cascade(self, bdname):
+        for parser in bdnorm.parsers_for_number:
+            status, parsed = parser.parse(bdname)
+            if status:
+                return parser, parsed
+        return None, ["", "", ""]
+
+    def test_same_as_cascade(self):
+        datas = (
+            datas_base
+            + datas_without_series
+            + datas_real_life
+            + datas_debug
+            + datas_next
+        )
+        for t in datas:
+            status, parsed = bdnorm.parser_special_of.parse(t[0])
+            bdname = parsed[0] if status else t[0]
+            self.assertEqual(self._cascade(bdname), bdnorm.parser_engine.parse(bdname))
+
+    def test_no_number(self):
+        parser, parsed = bdnorm.parser_engine.parse("no number here.cbz")
+        self.assertIsNone(parser)
+        self.assertEqual(parsed, ["", "", ""])
+        parser, parsed = bdnorm.parser_engine.parse("Valerian HS - Espace.cbr")
+        self.assertIsInstance(parser, bdnorm.ParseSpecialHS)
+
+    def test_unicode_digits(self):
+        # \d also matches non ascii digits
+        parser, parsed = bdnorm.parser_engine.parse("serie \u0661\u0662 title.cbz")
+        self.assertIsInstance(parser, bdnorm.ParseNormalCase)
+
+
+class MemoTests(unittest.TestCase):
+    """memo caches of pretty and friends"""
+
+    def test_to_ascii(self):
+        self.assertEqual(bdnorm.to_ascii("Là où va l'Indien"), "La ou va l'Indien")
+        self.assertEqual(bdnorm.to_ascii("Vinéa"), "Vinea")
+
+    def test_pretty(self):
+        self.assertEqual(bdnorm.pretty("le jour du soleil noir"), "Le.Jour.du.Soleil.Noir")
+        self.assertEqual(bdnorm.pretty(""), "")
+
+    def test_hits(self):
+        series = ["XIII Mystery", "Les Bidochon", "Yoko Tsuno", "Tif et Tondu"] * 2500
+        bdnorm.pretty.cache_clear()
+        for serie in series:
+            bdnorm.pretty(serie)
+        info = bdnorm.memo_info()["pretty"]
+        self.assertEqual(info.misses, 4)
+        self.assertEqual(info.hits, len(series) - 4)
+
+
+class DirectoryTests(unittest.TestCase):
+    """walk and plan a small tree"""
+
+    def setUp(self):
+        bdnorm.opts = bdnorm.opts_parser.parse_args(["dir"])
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, "XIII", "Mystery"))
+        for name in [
+            "XIII/XIII 01 - Le jour du soleil noir.cbr",
+            "XIII/XIII 02 - La ou va l Indien.cbr",
+            "XIII/Mystery/XIII Mystery - T01 - La Mangouste.pdf",
+            "Les Bidochon - tome 19.pdf",
+            ".hidden 01 - file.pdf",
+        ]:
+            open(os.path.join(self.root, name), "w").close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _glob_walk(self, current):
+        for bd in glob.glob("{:s}/*".format(current)):
+            if os.path.isdir(bd):
+                yield from self._glob_walk(bd)
+            else:
+                yield bd
+
+    def test_walk_like_glob(self):
+        walked = [bd for bd, cached in bdnorm.walk_directory(self.root)]
+        self.assertEqual(list(self._glob_walk(self.root)), walked)
+        self.assertEqual(len(walked), 4)
+
+    def test_jobs(self):
+        serial = list(bdnorm.plan_files(bdnorm.walk_directory(self.root)))
+        parallel = list(
+            bdnorm.plan_files(bdnorm.walk_directory(self.root), jobs=2, chunksize=1)
+        )
+        self.assertEqual(serial, parallel)
+
+    def test_rename_plan(self):
+        plans = bdnorm.iter_rename_plan(self.root)
+        first = next(plans)
+        self.assertIsInstance(first, bdnorm.RenamePlan)
+        plans = {os.path.basename(p.source): p for p in bdnorm.iter_rename_plan(self.root)}
+        plan = plans["XIII 01 - Le jour du soleil noir.cbr"]
+        self.assertEqual(plan.rule, "ParseNormalCase")
+        self.assertEqual(plan.status, "move")
+        self.assertEqual(
+            plan.target,
+            os.path.join(self.root, "XIII", "XIII_01_Le.Jour.du.Soleil.Noir.cbr"),
+        )
+
+    def test_collisions(self):
+        for name, content in [
+            ("XIII/XIII_01_Le.Jour.du.Soleil.Noir.cbr", "a"),
+            ("XIII/XIII-02-La ou va l Indien.cbr", "b"),
+        ]:
+            with open(os.path.join(self.root, name), "w") as f:
+                f.write(content)
+        index = bdnorm.TargetIndex(hash_collisions=True)
+        plans = {
+            os.path.basename(p.source): p
+            for p in bdnorm.iter_rename_plan(self.root, index=index)
+        }
+        # an existing file is already there
+        plan = plans["XIII 01 - Le jour du soleil noir.cbr"]
+        self.assertEqual(plan.status, "collision")
+        # two files going to the same name, same empty content or not
+        first = plans["XIII 02 - La ou va l Indien.cbr"]
+        second = plans["XIII-02-La ou va l Indien.cbr"]
+        self.assertEqual(first.target, second.target)
+        statuses = sorted([first.status, second.status])
+        self.assertEqual(statuses, ["collision", "move"])
+
+    def test_duplicates(self):
+        open(os.path.join(self.root, "Les-Bidochon-tome-19.pdf"), "w").close()
+        index = bdnorm.TargetIndex(hash_collisions=True)
+        statuses = sorted(
+            p.status
+            for p in bdnorm.iter_rename_plan(self.root, index=index)
+            if "Bidochon" in p.source
+        )
+        self.assertEqual(statuses, ["duplicate", "move"])
+
+    def test_formats(self):
+        plans = list(bdnorm.iter_rename_plan(self.root))
+        out = io.StringIO()
+        writer = bdnorm.JsonWriter(out, bufsize=2)
+        for plan in plans:
+            writer.write(plan)
+        writer.close()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[0])["source"], plans[0].source)
+
+        out = io.StringIO()
+        writer = bdnorm.CsvWriter(out)
+        for plan in plans:
+            writer.write(plan)
+        writer.close()
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual([r["target"] for r in rows], [p.target for p in plans])
+
+    def test_shell(self):
+        source = os.path.join(self.root, "XIII 03 - L'\"Indien\" $HOME.cbr")
+        open(source, "w").close()
+        out = io.StringIO()
+        writer = bdnorm.ShellWriter(out)
+        for plan in bdnorm.iter_rename_plan(self.root):
+            writer.write(plan)
+        writer.close()
+        subprocess.run(["sh", "-c", out.getvalue()], check=True)
+        self.assertFalse(os.path.exists(source))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.root, "XIII_03_L.Indien.HOME.cbr"))
+        )
+
+    def test_journal(self):
+        bdnorm.opts.force = True
+        journal = os.path.join(self.root, ".bdnorm.journal")
+        moves = [p for p in bdnorm.iter_rename_plan(self.root) if p.status == "move"]
+        self.assertEqual(len(moves), 4)
+        bdnorm.write_journal(journal, moves)
+        # a crash after the first rename, before it is marked done
+        os.rename(moves[0].source, moves[0].target)
+        self.assertEqual(bdnorm.execute_journal(journal), (4, 0))
+        for plan in moves:
+            self.assertFalse(os.path.exists(plan.source))
+            self.assertTrue(os.path.exists(plan.target))
+        # nothing left to do
+        self.assertEqual(bdnorm.execute_journal(journal), (0, 0))
+
+        self.assertEqual(bdnorm.undo_journal(journal), (4, 0))
+        for plan in moves:
+            self.assertTrue(os.path.exists(plan.source))
+            self.assertFalse(os.path.exists(plan.target))
+        moves_read, done = bdnorm.read_journal(journal)
+        self.assertEqual(len(moves_read), 4)
+        self.assertEqual(done, set())
+
+    def _plan_journal(self):
+        bdnorm.opts.force = True
+        journal = os.path.join(self.root, ".bdnorm.journal")
+        moves = [p for p in bdnorm.iter_rename_plan(self.root) if p.status == "move"]
+        bdnorm.write_journal(journal, moves)
+        return journal, moves
+
+    def _write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_journal_target_created(self):
+        journal, moves = self._plan_journal()
+        # created between the plan and the execution
+        self._write(moves[0].target, "other")
+        self.assertEqual(bdnorm.execute_journal(journal), (3, 1))
+        self.assertTrue(os.path.exists(moves[0].source))
+        self.assertEqual(self._read(moves[0].target), "other")
+
+    def test_journal_source_replaced(self):
+        journal, moves = self._plan_journal()
+        # source gone, an unrelated file at target is not a move done
+        os.remove(moves[0].source)
+        self._write(moves[0].target, "other")
+        self.assertEqual(bdnorm.execute_journal(journal), (3, 1))
+        self.assertEqual(bdnorm.undo_journal(journal), (3, 0))
+        self.assertEqual(self._read(moves[0].target), "other")
+        self.assertFalse(os.path.exists(moves[0].source))
+
+    def test_rotate_journal(self):
+        journal, moves = self._plan_journal()
+        self.assertEqual(bdnorm.execute_journal(journal), (4, 0))
+        rotated = bdnorm.rotate_journal(journal)
+        self.assertFalse(os.path.exists(journal))
+        self.assertTrue(rotated.startswith(journal + "."))
+        # same second, another name
+        self._write(journal, "")
+        self.assertNotEqual(bdnorm.rotate_journal(journal), rotated)
+        self.assertIsNone(bdnorm.rotate_journal(journal))
+        # the previous run can still be undone
+        self.assertEqual(bdnorm.undo_journal(rotated), (4, 0))
+
+    def test_journal_relative(self):
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(os.path.dirname(self.root))
+        relative = os.path.basename(self.root)
+        bdnorm.opts.force = True
+        journal = os.path.join(relative, ".bdnorm.journal")
+        moves = [p for p in bdnorm.iter_rename_plan(relative) if p.status == "move"]
+        bdnorm.write_journal(journal, moves)
+        self.assertEqual(bdnorm.execute_journal(journal), (4, 0))
+        # undo from another directory
+        os.chdir(self.root)
+        self.assertEqual(bdnorm.undo_journal(os.path.join(self.root, ".bdnorm.journal")), (4, 0))
+
+    def test_undo_target_replaced(self):
+        journal, moves = self._plan_journal()
+        self.assertEqual(bdnorm.execute_journal(journal), (4, 0))
+        os.remove(moves[0].target)
+        self._write(moves[0].target, "other")
+        self.assertEqual(bdnorm.undo_journal(journal), (3, 1))
+        self.assertEqual(self._read(moves[0].target), "other")
+        self.assertFalse(os.path.exists(moves[0].source))
+
+    def test_cache(self):
+        # outside of the tree, writing it would change the mtime of root
+        other = tempfile.TemporaryDirectory()
+        self.addCleanup(other.cleanup)
+        path = os.path.join(other.name, "cache.db")
+        cache = bdnorm.PlanCache(path)
+        first = list(bdnorm.iter_rename_plan(self.root, cache=cache))
+        cache.close()
+        self.assertEqual(cache.misses, 4)
+        self.assertEqual(cache.dirs_listed, 3)
+
+        cache = bdnorm.PlanCache(path)
+        second = list(bdnorm.iter_rename_plan(self.root, cache=cache))
+        cache.close()
+        self.assertEqual(first, second)
+        self.assertEqual(cache.hits, 4)
+        self.assertEqual(cache.misses, 0)
+        self.assertEqual(cache.dirs_unchanged, 3)
+
+        # new rules: everything is parsed again
+        cache = bdnorm.PlanCache(path, version=bdnorm.RULES_VERSION + 1)
+        third = list(bdnorm.iter_rename_plan(self.root, cache=cache))
+        cache.close()
+        self.assertEqual(first, third)
+        self.assertEqual(cache.misses, 4)
+
+
 if __name__ == "__main__":
     unittest.main()
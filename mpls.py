@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# read bluray playlists (.mpls) without libbluray
+# and find the playlist with the main title
+#    mpls.py BDMV/PLAYLIST            -> path of the best playlist
+#    mpls.py --clips 00800.mpls       -> m2ts files in playing order
+#    mpls.py --chapters 00800.mpls    -> start of each chapter in seconds
+# Author: P. Aubert pierreaubert@yahoo.fr
+# Apache 2 License
+# ----------------------------------------------------------------------
+import os
+import sys
+import struct
+import argparse
+import collections
+
+opts_parser = argparse.ArgumentParser(
+    description="Find the main playlist of a bluray and list its clips."
+)
+opts_parser.add_argument(
+    "--clips", help="print the m2ts files of the playlist", action="store_true"
+)
+opts_parser.add_argument(
+    "--chapters",
+    help="print the start of each chapter in seconds",
+    action="store_true",
+)
+opts_parser.add_argument(
+    "--tries",
+    help="number of playlists tried before giving up",
+    type=int,
+    default=20,
+)
+opts_parser.add_argument("path", help="a .mpls file or a PLAYLIST directory")
+opts = None
+
+# time stamps are in 45kHz ticks
+TICKS = 45000
+
+# mark type of a chapter
+MARK_ENTRY = 1
+
+PlayItem = collections.namedtuple("PlayItem", ["clip", "codec", "in_time", "out_time"])
+Mark = collections.namedtuple("Mark", ["type", "item", "time"])
+Playlist = collections.namedtuple("Playlist", ["path", "version", "items", "marks"])
+
+
+class MplsError(Exception):
+    """not a playlist or a truncated one"""
+
+
+def unpack(fmt, data, offset):
+    try:
+        return struct.unpack_from(fmt, data, offset)
+    except struct.error:
+        raise MplsError("truncated playlist at offset {0}".format(offset))
+
+
+def parse_items(data, start):
+    """PlayItems of the PlayList section at *start*"""
+    (count,) = unpack(">H", data, start + 6)
+    items = []
+    pos = start + 10
+    for _ in range(count):
+        (length,) = unpack(">H", data, pos)
+        name, codec, in_time, out_time = unpack(">5s4s3xII", data, pos + 2)
+        items.append(
+            PlayItem(
+                name.decode("ascii", "replace"),
+                codec.decode("ascii", "replace"),
+                in_time,
+                out_time,
+            )
+        )
+        pos += 2 + length
+    return items
+
+
+def parse_marks(data, start):
+    """marks of the PlayListMark section at *start*"""
+    (count,) = unpack(">H", data, start + 4)
+    marks = []
+    pos = start + 6
+    for _ in range(count):
+        mark_type, item, time = unpack(">xBHI", data, pos)
+        marks.append(Mark(mark_type, item, time))
+        pos += 14
+    return marks
+
+
+def parse_mpls(data, path=None):
+    """Playlist from the content of a .mpls file"""
+    if data[0:4] != b"MPLS":
+        raise MplsError("{0} is not a playlist".format(path))
+    version = data[4:8].decode("ascii", "replace")
+    playlist_start, marks_start = unpack(">II", data, 8)
+    items = parse_items(data, playlist_start)
+    marks = parse_marks(data, marks_start)
+    return Playlist(path, version, items, marks)
+
+
+def read_mpls(path):
+    with open(path, "rb") as f:
+        return parse_mpls(f.read(), path)
+
+
+def duration(playlist):
+    """length of *playlist* in seconds"""
+    return sum(i.out_time - i.in_time for i in playlist.items) / TICKS
+
+
+def clips(playlist):
+    """m2ts files in playing order"""
+    return ["{0}.m2ts".format(i.clip) for i in playlist.items]
+
+
+def chapters(playlist):
+    """start of each chapter in seconds from the start of the playlist"""
+    starts = []
+    offset = 0
+    for i in playlist.items:
+        starts.append(offset)
+        offset += i.out_time - i.in_time
+    r = []
+    for m in playlist.marks:
+        if m.type != MARK_ENTRY or m.item >= len(playlist.items):
+            continue
+        t = (starts[m.item] + m.time - playlist.items[m.item].in_time) / TICKS
+        if len(r) == 0 or t > r[-1]:
+            r.append(t)
+    return r
+
+
+def is_suspect(playlist):
+    """
+    some discs hide the main title behind fake playlists:
+    the same clip played again and again or hundreds of items
+    """
+    counts = collections.Counter(i.clip for i in playlist.items)
+    if len(counts) == 0:
+        return True
+    if len(counts) == 1 and max(counts.values()) > 3:
+        return True
+    return max(counts.values()) > 100
+
+
+def read_playlists(directory):
+    """all playlists of *directory*, unreadable ones are skipped"""
+    playlists = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".mpls"):
+            continue
+        try:
+            playlists.append(read_mpls(os.path.join(directory, name)))
+        except (OSError, MplsError) as e:
+            print(("Warning: {0}".format(e)), file=sys.stderr)
+    return playlists
+
+
+def select_playlist(playlists, tries=20):
+    """longest playlist which is not suspect, among the *tries* longest ones"""
+    ranked = sorted(playlists, key=lambda p: (-duration(p), p.path))
+    for playlist in ranked[0:tries]:
+        if not is_suspect(playlist):
+            return playlist
+        print(
+            ("Warning: {0} is suspect, trying next one".format(playlist.path)),
+            file=sys.stderr,
+        )
+    return None
+
+
+# main
+if __name__ == "__main__":
+
+    opts = opts_parser.parse_args()
+
+    try:
+        if os.path.isdir(opts.path):
+            playlist = select_playlist(read_playlists(opts.path), opts.tries)
+        else:
+            playlist = read_mpls(opts.path)
+    except (OSError, MplsError) as e:
+        print(("Error: {0}".format(e)), file=sys.stderr)
+        sys.exit(1)
+
+    if playlist is None:
+        print(("Couldn't find a playlist in {0}".format(opts.path)), file=sys.stderr)
+        sys.exit(1)
+
+    if opts.clips:
+        for clip in clips(playlist):
+            print(clip)
+    elif opts.chapters:
+        for chapter in chapters(playlist):
+            print(("{0:.3f}".format(chapter)))
+    else:
+        print(playlist.path)
+
+    sys.exit(0)
@@ -0,0 +1,108 @@
+import os
+import struct
+import tempfile
+import unittest
+import mpls
+
+
+def build_item(clip, in_time, out_time):
+    """a PlayItem as written on disc"""
+    body = clip.encode("ascii") + b"M2TS" + b"\x00\x01" + b"\x00"
+    body += struct.pack(">II", in_time, out_time)
+    # UO mask, flags and still mode
+    body += b"\x00" * 8 + b"\x00\x00" + b"\x00" + b"\x00\x00"
+    return struct.pack(">H", len(body)) + body
+
+
+def build_mpls(items, marks=(), version=b"0200"):
+    """content of a .mpls file with *items* (clip, in, out) and *marks* (type, item, time)"""
+    playlist = b"".join(build_item(*i) for i in items)
+    playlist = b"\x00\x00" + struct.pack(">HH", len(items), 0) + playlist
+    playlist = struct.pack(">I", len(playlist)) + playlist
+    mark = b"".join(
+        struct.pack(">BBHIHI", 0, t, i, time, 0xFFFF, 0) for t, i, time in marks
+    )
+    mark = struct.pack(">IH", len(mark) + 2, len(marks)) + mark
+    header_size = 40
+    header = b"MPLS" + version
+    header += struct.pack(">III", header_size, header_size + len(playlist), 0)
+    header += b"\x00" * (header_size - len(header))
+    return header + playlist + mark
+
+
+class ParseTests(unittest.TestCase):
+    def test_items(self):
+        data = build_mpls([("00001", 0, 45000 * 60), ("00002", 900, 900 + 45000 * 30)])
+        p = mpls.parse_mpls(data, "00000.mpls")
+        self.assertEqual(p.version, "0200")
+        self.assertEqual(mpls.clips(p), ["00001.m2ts", "00002.m2ts"])
+        self.assertEqual(p.items[1].codec, "M2TS")
+        self.assertEqual(p.items[1].in_time, 900)
+        self.assertEqual(mpls.duration(p), 90)
+
+    def test_marks(self):
+        data = build_mpls([("00001", 0, 45000)], [(1, 0, 0), (2, 0, 4500)])
+        p = mpls.parse_mpls(data)
+        self.assertEqual(p.marks, [mpls.Mark(1, 0, 0), mpls.Mark(2, 0, 4500)])
+
+    def test_chapters(self):
+        data = build_mpls(
+            [("00001", 4500, 4500 + 45000 * 60), ("00002", 0, 45000 * 60)],
+            [(1, 0, 4500), (2, 0, 9000), (1, 0, 4500 + 45000 * 30), (1, 1, 45000 * 10)],
+        )
+        p = mpls.parse_mpls(data)
+        self.assertEqual(mpls.chapters(p), [0, 30, 70])
+
+    def test_not_mpls(self):
+        with self.assertRaises(mpls.MplsError):
+            mpls.parse_mpls(b"HDMV0200" + b"\x00" * 32)
+
+    def test_truncated(self):
+        data = build_mpls([("00001", 0, 45000)])
+        with self.assertRaises(mpls.MplsError):
+            mpls.parse_mpls(data[0:50])
+
+
+class SelectTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        hour = 45000 * 3600
+        self.playlists = {
+            # same clip again and again: suspect
+            "00001.mpls": [("00010", 0, hour)] * 8,
+            # hundreds of items: suspect
+            "00002.mpls": [("00011", 0, hour // 100), ("00012", 0, hour // 100)] * 101,
+            # main title
+            "00003.mpls": [("00020", 0, hour), ("00022", 0, hour // 2), ("00021", 0, 10)],
+            # short extra
+            "00004.mpls": [("00030", 0, hour // 4)],
+        }
+        for name, items in self.playlists.items():
+            with open(os.path.join(self.tmp.name, name), "wb") as f:
+                f.write(build_mpls(items))
+        with open(os.path.join(self.tmp.name, "broken.mpls"), "wb") as f:
+            f.write(b"MPLS")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_suspect(self):
+        playlists = dict(
+            (os.path.basename(p.path), p) for p in mpls.read_playlists(self.tmp.name)
+        )
+        self.assertEqual(len(playlists), 4)
+        self.assertTrue(mpls.is_suspect(playlists["00001.mpls"]))
+        self.assertTrue(mpls.is_suspect(playlists["00002.mpls"]))
+        self.assertFalse(mpls.is_suspect(playlists["00003.mpls"]))
+
+    def test_select(self):
+        p = mpls.select_playlist(mpls.read_playlists(self.tmp.name))
+        self.assertEqual(os.path.basename(p.path), "00003.mpls")
+        self.assertEqual(mpls.clips(p), ["00020.m2ts", "00022.m2ts", "00021.m2ts"])
+
+    def test_tries(self):
+        self.assertIsNone(mpls.select_playlist(mpls.read_playlists(self.tmp.name), 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
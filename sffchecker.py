@@ -9,8 +9,17 @@
 import glob
 import os
 import re
-import itertools
+import io
+import sys
+import csv
+import json
+import sqlite3
+import hashlib
+import pathlib
+import functools
+import collections
 import argparse
+import concurrent.futures
 from pprint import pprint
 
 
@@ -38,24 +47,74 @@ opts_parser.add_argument(
     action="store",
     default="grouped",
 )
+opts_parser.add_argument(
+    "-F",
+    "--format",
+    help="text for humans or a machine readable report",
+    dest="format",
+    choices=["text", "json", "jsonl", "csv"],
+    action="store",
+    default="text",
+)
 opts_parser.add_argument(
     "--calibre", help="calibre directory path", dest="calibre", action="store"
 )
+opts_parser.add_argument(
+    "--calibre-source",
+    help="read calibre from its metadata.db or from the files",
+    dest="calibre_source",
+    choices=["db", "fs"],
+    action="store",
+    default="fs",
+)
 opts_parser.add_argument("--sff", help="SFF directory path", dest="sff", action="store")
+opts_parser.add_argument(
+    "-j",
+    "--jobs",
+    help="number of authors scanned in parallel",
+    dest="jobs",
+    type=int,
+    default=1,
+)
+opts_parser.add_argument(
+    "--fuzzy",
+    help="also match authors with initials, dropped or swapped names",
+    action="store_true",
+    default=False,
+)
+opts_parser.add_argument(
+    "--variants",
+    help="keep the author variants in this json file between runs",
+    dest="variants",
+    action="store",
+)
+opts_parser.add_argument(
+    "--state",
+    help="sqlite file remembering books already reported, only new books are shown",
+    dest="state",
+    action="store",
+)
 opts_parser.add_argument(
     "-A", "--author", help="1 specific author to look at", dest="author", action="store"
 )
 opts = None
 
 dir_calibre = '{home}/Documents/Books/Calibre/Pierre'.format(home=os.environ['HOME'])
+calibre_source = "fs"
 dir_sffupdate = '/Volume/media/books/sff' # '{home}/sff'.format(home=os.environ['HOME'])
 
+# warnings and diagnostics, sent to stderr with a machine readable report
+info = sys.stdout
+
 # a re for looking for initials
 pattern_initiales = re.compile(r"([A-Z](\.|_| ))+")
 
 # a re to split author names
 pattern_authors_splitter = re.compile(r";|&")
 
+# a re to split a name in words, initials are words too
+pattern_name_tokens = re.compile(r"[^\s.,_]+")
+
 # colors
 C_NORMAL = "\033[30m"
 C_RED = "\033[31m"
@@ -107,39 +166,284 @@ def calibre_author_to_title(book):
     return book[0:pos].split("-")
 
 
-def check(author, book_sff):
+class CalibreIndex:
+    """
+    # titles of all books in calibre, by author directory
+    # the library is scanned once, then each check is a set lookup
+    """
+
+    def __init__(self, root=None, source="fs"):
+        self.root = root
+        self.source = source
+        self.titles = {}
+        self.unions = {}
+        if root is None:
+            return
+        if source == "db":
+            try:
+                self.scan_db()
+                return
+            except (sqlite3.Error, OSError) as e:
+                print(
+                    ("(warning) cannot read calibre database: {0}, scanning files".format(e)),
+                    file=info,
+                )
+                self.titles = {}
+        self.scan()
+
+    def add(self, author_dir, book):
+        """add calibre file *book* found in *author_dir*"""
+        titles = self.titles.setdefault(author_dir, set())
+        for calibre_title in calibre_author_to_title(book):
+            titles.add(calibre_title.strip().lower())
+        self.unions = {}
+
+    @staticmethod
+    def entries(path):
+        """entries of *path* which are not hidden, none if it can't be read"""
+        try:
+            with os.scandir(path) as it:
+                return [e for e in it if not e.name.startswith(".")]
+        except OSError:
+            return []
+
+    def scan(self):
+        """read root/author/book/*.* (hidden entries are skipped like glob does)"""
+        for author in self.entries(self.root):
+            if not author.is_dir():
+                continue
+            self.titles.setdefault(author.name, set())
+            for book in self.entries(author.path):
+                if not book.is_dir():
+                    continue
+                for f in self.entries(book.path):
+                    if "." in f.name and f.is_file():
+                        self.add(author.name, f.name)
+
+    def scan_db(self):
+        """read books and formats from root/metadata.db (read only)"""
+        db = pathlib.Path(self.root, "metadata.db").resolve()
+        if not db.is_file():
+            raise OSError("{0} doesn't exist".format(db))
+        conn = sqlite3.connect("{0}?mode=ro".format(db.as_uri()), uri=True)
+        try:
+            for path, name, fmt in conn.execute(
+                "SELECT books.path, data.name, data.format FROM books "
+                "LEFT JOIN data ON data.book = books.id"
+            ):
+                author = path.split("/")[0]
+                self.titles.setdefault(author, set())
+                if name is not None:
+                    self.add(author, "{0}.{1}".format(name, fmt.lower()))
+        finally:
+            conn.close()
+
+    def authors(self):
+        """author directories, like scan_dir"""
+        return [a.strip() for a in self.titles]
+
+    def lookup(self, author):
+        """all titles of author directories containing *author*"""
+        if author not in self.unions:
+            titles = set()
+            for author_dir, t in self.titles.items():
+                if author in author_dir:
+                    titles |= t
+            self.unions[author] = titles
+        return self.unions[author]
+
+
+calibre_index = None
+
+
+def get_calibre_index():
+    """index of dir_calibre, built on first use"""
+    global calibre_index
+    if (
+        calibre_index is None
+        or calibre_index.root != dir_calibre
+        or calibre_index.source != calibre_source
+    ):
+        calibre_index = CalibreIndex(dir_calibre, calibre_source)
+    return calibre_index
+
+
+def check(author, book_sff, index=None):
     """return true if it looks like *book* from *author* exist in calibre"""
+    if index is None:
+        index = get_calibre_index()
     title_sff = sff_author_to_title(book_sff)
-    books_calibre = []
-    for f in glob.glob(dir_calibre + "/*" + author["calibre"] + "*/*/*.*"):
-        if os.path.isfile(f):
-            calibre_titles = calibre_author_to_title(os.path.basename(f))
-            for calibre_title in calibre_titles:
-                books_calibre.append(calibre_title.strip().lower())
-    #    print(title_sff)
-    #    print(set(books_calibre))
-    return title_sff not in set(books_calibre)
+    return title_sff not in index.lookup(author["calibre"])
 
 
-def scan(author_link):
+class SFFIndex:
+    """
+    # authors of the sff update and their books
+    # each directory is read once with os.scandir and entry types come
+    # from the listing, so there is no isdir/isfile stat per entry
+    # books of an author are read the first time they are asked for
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.dirs = {}
+        self.books = {}
+        self.entries = {}
+        self.root_entries = 0
+        if root is not None:
+            self.scan()
+
+    def scan(self):
+        """read root, a missing or unreadable root gives an empty index"""
+        try:
+            with os.scandir(self.root) as it:
+                for e in it:
+                    self.root_entries += 1
+                    if not e.name.startswith(".") and e.is_dir():
+                        self.dirs[e.name.strip()] = e.path
+        except OSError:
+            pass
+
+    def authors(self):
+        """author directories, like scan_dir"""
+        return list(self.dirs)
+
+    def list_books(self, author):
+        """names of the files of *author* or None if there is no such directory"""
+        author = author.strip()
+        if author not in self.dirs:
+            return None
+        if author not in self.books:
+            books = []
+            count = 0
+            try:
+                with os.scandir(self.dirs[author]) as it:
+                    for e in it:
+                        count += 1
+                        if not e.name.startswith(".") and e.is_file():
+                            books.append(e.name)
+            except OSError:
+                # unreadable like glob would see it: no books
+                books = []
+            self.entries[author] = count
+            self.books[author] = books
+        return self.books[author]
+
+    def stats(self):
+        """(directories listed, stat calls saved compared to glob + isdir/isfile)"""
+        listed = 1 + len(self.books)
+        # one stat per entry plus the isdir of each scanned author
+        saved = self.root_entries + sum(self.entries.values()) + len(self.books)
+        return listed, saved
+
+
+sff_index = None
+
+
+def get_sff_index():
+    """index of dir_sffupdate, built on first use"""
+    global sff_index
+    if sff_index is None or sff_index.root != dir_sffupdate:
+        sff_index = SFFIndex(dir_sffupdate)
+    return sff_index
+
+
+def scan(author_link, index=None, seen=None):
     """
     display *author* and corresponding names
+    *seen* maps books reported by a previous run to their status, they are
+    skipped unless their status changed
     """
+    if index is None:
+        index = get_sff_index()
     author = author_link["sff"].strip()
-    author_dir = dir_sffupdate + "/" + author
-    if not os.path.isdir(author_dir):
-        print(("author is incorrect: directory {0} doesn't exist!".format(author_dir)))
+    books = index.list_books(author)
+    if books is None:
+        author_dir = dir_sffupdate + "/" + author
+        print(
+            ("author is incorrect: directory {0} doesn't exist!".format(author_dir)),
+            file=sys.stderr,
+        )
         return []
     ll = []
-    for f in glob.glob(dir_sffupdate + "/" + author + "/*"):
-        # print('tracking files: {0}'.format(f))
-        if os.path.isfile(f):
-            b = os.path.basename(f)
-            status = check(author_link, b)
-            ll.append([status, b])
+    for b in books:
+        status = check(author_link, b)
+        if seen is not None and seen.get(b) == status:
+            continue
+        ll.append([status, b])
     return ll
 
 
+class StateStore:
+    """
+    # books of the sff updates already reported, kept in a sqlite file
+    # a run only reports books which are not in the store or whose status
+    # changed since they were stored
+    # books are identified by author and file name, a new version of a
+    # book in sff has a new name (# v1.1)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS books ("
+            "author TEXT, name TEXT, status INTEGER, PRIMARY KEY (author, name))"
+        )
+        self.books = {}
+        for author, name, status in self.conn.execute(
+            "SELECT author, name, status FROM books"
+        ):
+            self.books.setdefault(author, {})[name] = bool(status)
+        self.known = sum(len(b) for b in self.books.values())
+        self.added = 0
+
+    def seen(self, author):
+        """books of *author* already reported and their status"""
+        return self.books.get(author.strip(), {})
+
+    def record(self, author, status_title):
+        """remember books of *author* reported by this run"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO books VALUES (?, ?, ?)",
+            [(author.strip(), b, int(bool(s))) for s, b in status_title],
+        )
+        self.added += len(status_title)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def scan_authors(author_links, jobs=1, state=None):
+    """
+    yield (*author_link*, books) in the order of *author_links*
+    with *jobs* > 1 authors are scanned by a pool of threads
+    with a *state* only books not seen before or whose status changed are
+    returned
+    """
+
+    def scan_new(author_link):
+        seen = None
+        if state is not None:
+            seen = state.seen(author_link["sff"])
+        return scan(author_link, None, seen)
+
+    author_links = list(author_links)
+    if jobs <= 1 or len(author_links) == 0:
+        for author_link in author_links:
+            yield author_link, scan_new(author_link)
+        return
+    # build the indexes before the threads share them
+    get_calibre_index()
+    get_sff_index()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for author_link, status_title in zip(
+            author_links, executor.map(scan_new, author_links)
+        ):
+            yield author_link, status_title
+
+
 def display_book(color, title):
     return """- {color}NEW{normal} - {title}""".format(
         color=color, normal=C_NORMAL, title=title
@@ -156,49 +460,6 @@ def display_linear(status_title):
             print(("    {0}".format(display_book(C_BLUE, title))))
 
 
-def iter_group_on_title(dtitle):
-    # print('dtitle {}'.format(dtitle))
-    r = None
-    if opts.debug:
-        print(("(debug) {0}".format(str(dtitle))))
-    dot = dtitle["title"].split(".")
-    sharp = dot[0].split("#")
-    if len(sharp) == 2:
-        r = sharp[0]
-    else:
-        r = dot[0]
-    return r.strip()
-
-
-def group_by_title(ltitles):
-    # pprint(ltitles)
-    titles = []
-    def title_sort(a):
-        n = a["number"]
-        if n is None:
-            return "--"
-        else:
-            return n
-    stitles = sorted(ltitles, key=lambda a: title_sort(a))
-    for t, isuffix in itertools.groupby(stitles, iter_group_on_title):
-        raw = list(isuffix)
-        extra = None
-        sharp = raw[0]["title"].split("#")
-        if len(sharp) > 1:
-            extra = ".".join(sharp[1].split(".")[0:-1]).strip()
-        suffix = [r["title"].split(".")[-1] for r in raw]
-        titles.append(
-            {
-                "title": t,
-                "suffix": suffix,
-                "number": raw[0]["number"],
-                "status": raw[0]["status"],
-                "extra": extra,
-            }
-        )
-    return titles
-
-
 def remove_last_number(s):
     # remove last serie number
     t = s.strip()
@@ -223,73 +484,120 @@ def grab_last_number(s):
         return None
 
 
-def iter_group_on_collection(status_title):
-    # return an iterator breaking on collection
-    title = status_title[1]
-    splitted = title.split("-")
-    l = len(splitted)
+SFFBook = collections.namedtuple(
+    "SFFBook", ["author", "collection", "number", "title", "version", "extension"]
+)
+
+
+@functools.lru_cache(maxsize=None)
+def split_title(title):
+    """
+    # 'title # (v1.0).epub' -> ('title', '(v1.0)', 'epub')
+    """
+    dot = title.split(".")
+    sharp = dot[0].split("#")
+    if len(sharp) == 2:
+        base = sharp[0]
+    else:
+        base = dot[0]
+    version = None
+    sharp = title.split("#")
+    if len(sharp) > 1:
+        version = ".".join(sharp[1].split(".")[0:-1]).strip()
+    return base.strip(), version, dot[-1]
+
+
+@functools.lru_cache(maxsize=None)
+def parse_sff_book(book):
+    """
+    # split a sff file name into a SFFBook, usually
+    #       author - title.epub
+    #       author - serie number - title # version.epub
+    #       author - serie - number - title # version.epub
+    # title is None if the name is not understood
+    """
+    work = book.split("-")
+    l = len(work)
+    collection = None
+    number = None
+    title = None
     if l == 2:
-        return "__none__"
-    elif l >= 3 and l<=7:
-        if opts.debug:
-            print(
-                (
-                    "(debug) |{0}| and |{1}|".format(
-                        splitted[1], remove_last_number(splitted[1])
-                    )
-                )
-            )
-        return remove_last_number(splitted[1])
+        collection = "__none__"
+        title = work[1].strip()
+    elif l >= 3 and l <= 7:
+        collection = remove_last_number(work[1])
+        if l == 3:
+            number = grab_last_number(work[1])
+            title = work[2].strip()
+        elif l == 4:
+            # the number is alone between dashes
+            number = grab_last_number("- " + work[2].strip())
+            title = work[3].strip()
     else:
         print(
             (
                 "(error) splitted len's={0} for {1}, don't know what to do!".format(
-                    l, title
+                    l, book
                 )
-            )
+            ),
+            file=sys.stderr,
+        )
+    if title is None:
+        return SFFBook(work[0].strip(), collection, number, None, None, None)
+    base, version, extension = split_title(title)
+    return SFFBook(work[0].strip(), collection, number, base, version, extension)
+
+
+def group_titles(books):
+    """
+    # *books* are (SFFBook, status), books with the same title are merged
+    # titles are sorted on their number
+    """
+
+    def title_sort(a):
+        n = a[0].number
+        if n is None:
+            return "--"
+        else:
+            return n
+
+    titles = {}
+    for book, status in sorted(books, key=title_sort):
+        if book.title in titles:
+            titles[book.title]["suffix"].append(book.extension)
+        else:
+            titles[book.title] = {
+                "title": book.title,
+                "suffix": [book.extension],
+                "number": book.number,
+                "status": status,
+                "extra": book.version,
+            }
+    return list(titles.values())
+
+
+def group_by_title(ltitles):
+    books = []
+    for t in ltitles:
+        base, version, extension = split_title(t["title"])
+        books.append(
+            (SFFBook(None, None, t["number"], base, version, extension), t["status"])
         )
+    return group_titles(books)
 
 
 def group_by_collection(status_title):
+    # one pass: each file name is parsed once and put in its collection
     ugroup = {}
-    for collection, ititles in itertools.groupby(
-        status_title, iter_group_on_collection
-    ):
-        raw = list(ititles)
-        for r in raw:
-            title = None
-            number = None
-            status = r[0]
-            work = r[1].split("-")
-            if collection == "__none__":
-                title = work[1].strip()
-            elif len(work) == 3:
-                number = grab_last_number(work[1])
-                title = work[2].strip()
-            elif len(work) == 4:
-                number = grab_last_number(work[2])
-                title = work[3].strip()
-
-            if len(work) > 2 and title is not None:
-                if collection in ugroup:
-                    ugroup[collection].append(
-                        {
-                            "title": title,
-                            "number": number,
-                            "status": status,
-                        }
-                    )
-                else:
-                    ugroup[collection] = [
-                        {
-                            "title": title,
-                            "number": number,
-                            "status": status,
-                        }
-                    ]
-
-    # pprint(ugroup)
-    groups = [{"collection": c, "titles": group_by_title(t)} for c, t in ugroup.items()]
+    for status, name in status_title:
+        book = parse_sff_book(name)
+        if book.title is None:
+            continue
+        if opts.debug:
+            print(("(debug) {0}".format(str(book))), file=info)
+        ugroup.setdefault(book.collection, []).append((book, status))
+
+    groups = [{"collection": c, "titles": group_titles(t)} for c, t in ugroup.items()]
     return groups
 
 
@@ -300,7 +608,7 @@ def display_grouped(status_title):
     cnt_series = 0
     for group in groups:
         if group["collection"] == "__none__":
-            cnt_books += 1
+            cnt_books += len(group["titles"])
         else:
             cnt_series += 1
 
@@ -308,8 +616,9 @@ def display_grouped(status_title):
         print("  Books")
     for group in groups:
         collection = group["collection"]
-        if collection == "__none__":
-            raw_title = group["titles"][0]
+        if collection != "__none__":
+            continue
+        for raw_title in group["titles"]:
             title = None
             if len(raw_title["suffix"]) == 1:
                 title = "{0}.{1}".format(raw_title["title"], raw_title["suffix"][0])
@@ -373,16 +682,179 @@ def display_grouped(status_title):
                     )
 
 
-def display(author_link, option):
+def display(author_link, option, status_title=None):
     author = author_link["sff"].strip()
     print(("{red}{author}{normal}".format(red=C_RED, normal=C_NORMAL, author=author)))
-    status_title = scan(author_link)
+    if status_title is None:
+        status_title = scan(author_link)
     if option == "linear":
         display_linear(status_title)
     else:
         display_grouped(status_title)
 
 
+def report_record(author_link, status_title):
+    """results of scan and group_by_collection for one author"""
+    return {
+        "author": author_link["sff"].strip(),
+        "calibre": author_link["calibre"],
+        "books": [{"status": s, "file": b} for s, b in status_title],
+        "collections": group_by_collection(status_title),
+    }
+
+
+class ReportWriter:
+    """
+    interface class for the machine readable reports
+    lines are kept and written by blocks, not one print per book
+    """
+
+    def __init__(self, out=None, bufsize=1024):
+        self.out = out if out is not None else sys.stdout
+        self.bufsize = bufsize
+        self.lines = []
+
+    def format(self, record):
+        """text for *record* (see report_record)"""
+        return ""
+
+    def write(self, author_link, status_title):
+        self.lines.append(self.format(report_record(author_link, status_title)))
+        if len(self.lines) >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        self.out.write("".join(self.lines))
+        self.out.flush()
+        self.lines = []
+
+    def close(self):
+        self.flush()
+
+
+class JsonReportWriter(ReportWriter):
+    """one json list of authors"""
+
+    def __init__(self, out=None, bufsize=1024):
+        super(JsonReportWriter, self).__init__(out, bufsize)
+        self.count = 0
+
+    def format(self, record):
+        sep = "[\n" if self.count == 0 else ",\n"
+        self.count += 1
+        return sep + json.dumps(record)
+
+    def close(self):
+        self.lines.append("[]\n" if self.count == 0 else "\n]\n")
+        self.flush()
+
+
+class JsonlReportWriter(ReportWriter):
+    """one json object per author and per line"""
+
+    def format(self, record):
+        return json.dumps(record) + "\n"
+
+
+class CsvReportWriter(ReportWriter):
+    """csv with a header line, one row per title"""
+
+    fields = [
+        "author",
+        "calibre",
+        "collection",
+        "number",
+        "title",
+        "suffix",
+        "extra",
+        "status",
+    ]
+
+    def __init__(self, out=None, bufsize=1024):
+        super(CsvReportWriter, self).__init__(out, bufsize)
+        self.csv = io.StringIO()
+        self.writer = csv.writer(self.csv)
+        self.lines.append(self.rows([self.fields]))
+
+    def rows(self, values):
+        self.writer.writerows(values)
+        lines = self.csv.getvalue()
+        self.csv.seek(0)
+        self.csv.truncate()
+        return lines
+
+    def format(self, record):
+        return self.rows(
+            [
+                [
+                    record["author"],
+                    record["calibre"],
+                    group["collection"],
+                    title["number"],
+                    title["title"],
+                    "|".join(title["suffix"]),
+                    title["extra"],
+                    "NEW" if title["status"] else "UPD",
+                ]
+                for group in record["collections"]
+                for title in group["titles"]
+            ]
+        )
+
+
+report_writers = {
+    "json": JsonReportWriter,
+    "jsonl": JsonlReportWriter,
+    "csv": CsvReportWriter,
+}
+
+
+def name_tokens(author):
+    """lower case words of *author*: 'A.G. Riddle' -> ['a', 'g', 'riddle']"""
+    return pattern_name_tokens.findall(author.lower())
+
+
+def token_match(a, b):
+    """same word or one is the initial of the other"""
+    if a == b:
+        return True
+    if len(a) == 1 or len(b) == 1:
+        return a[0] == b[0]
+    return False
+
+
+def fornames_match(f1, f2):
+    """
+    fornames match if the first ones match and the shortest list is
+    a subsequence of the other one (middle names can be dropped)
+    """
+    if len(f1) == 0 or len(f2) == 0:
+        return len(f1) == len(f2)
+    if not token_match(f1[0], f2[0]):
+        return False
+    if len(f1) > len(f2):
+        f1, f2 = f2, f1
+    i = 0
+    for t in f2:
+        if i < len(f1) and token_match(f1[i], t):
+            i += 1
+    return i == len(f1)
+
+
+def name_splits(author):
+    """
+    possible (name, fornames) of *author*
+    name is usually last, but calibre also has 'NAME, forname'
+    """
+    tokens = name_tokens(author)
+    if len(tokens) == 0:
+        return []
+    splits = [(tokens[-1], tokens[:-1])]
+    if len(tokens) > 1:
+        splits.append((tokens[0], tokens[1:]))
+    return splits
+
+
 def match_authors(calibre_author, sff_author):
     """
     return true if authors in both formatting match
@@ -392,27 +864,59 @@ def match_authors(calibre_author, sff_author):
     # 0/ easy case
     if calibre == sff:
         return True
-    # 1/ split on '&' or '-' in case of multiple authors
-    # 2/ if we have a ',' reverse name and forname
-    # 3/ expect name to match, a few guesses for fornames
-    sff_split_on_space = sff.split(" ")
-    sff_name = sff_split_on_space[-1]
-    sff_fornames = sff_split_on_space[1]
-    calibre_split_on_space = calibre.split(" ")
-    calibre_name = calibre_split_on_space[-1]
-    calibre_fornames = calibre_split_on_space[1]
-    #   a/ remove space                      A.G. Riddle -> A. G. Riddle
-    if calibre_name == sff_name and calibre_fornames.replace(
-        " ", ""
-    ) == sff_name.replace(" ", ""):
-        return True
-    #   b/ try to remove last forname        Jules Amedee Barbey d'Aurevilly ->  Jules Barbey d'Aurevilly
-    #   c/                                   Jules Amedee Barbey d'Aurevilly ->  J.A. Barbey d'Aurevilly
-    # 4/ do we have a match if we swap name and forname?
-    # failed
+    # 1/ same name, fornames may be initials   A.G. Riddle -> A. G. Riddle
+    # 2/ middle fornames can be dropped        Jules Amedee Barbey d'Aurevilly ->  Jules Barbey d'Aurevilly
+    #                                          Jules Amedee Barbey d'Aurevilly ->  J.A. Barbey d'Aurevilly
+    # 3/ name and forname can be swapped       Riddle A.G. -> A. G. Riddle
+    sff_tokens = name_tokens(sff)
+    if len(sff_tokens) == 0:
+        return False
+    sff_name = sff_tokens[-1]
+    sff_fornames = sff_tokens[:-1]
+    for name, fornames in name_splits(calibre):
+        if name == sff_name and fornames_match(fornames, sff_fornames):
+            return True
     return False
 
 
+class AuthorIndex:
+    """
+    # sff authors indexed by (name, initial of first forname)
+    # a calibre author is only compared with the few sff authors
+    # sharing the same key instead of all of them
+    """
+
+    def __init__(self, authors=()):
+        self.keys = {}
+        for author in authors:
+            self.add(author)
+
+    def add(self, author):
+        tokens = name_tokens(author)
+        if len(tokens) == 0:
+            return
+        key = (tokens[-1], tokens[0][0] if len(tokens) > 1 else "")
+        self.keys.setdefault(key, []).append(author)
+
+    def candidates(self, author):
+        """sff authors which may be *author*"""
+        found = []
+        for name, fornames in name_splits(author):
+            initial = fornames[0][0] if len(fornames) > 0 else ""
+            for candidate in self.keys.get((name, initial), []):
+                if candidate not in found:
+                    found.append(candidate)
+        return found
+
+    def lookup(self, calibre_authors):
+        """sff author matching *calibre_authors*, None if none or ambiguous"""
+        for author in pattern_authors_splitter.split(calibre_authors):
+            matches = [c for c in self.candidates(author) if match_authors(author, c)]
+            if len(matches) == 1:
+                return matches[0]
+        return None
+
+
 def lookslikeinitial(lemme):
     # return true if it looks like some initials
     # L.P.
@@ -437,13 +941,14 @@ def to_sff(calibre_author):
     # BUG BUG
 
 
+@functools.lru_cache(maxsize=None)
 def normalize_author(calibre_author):
     name = calibre_author.strip()
     # take care of double spaces
     name = " ".join(name.split())
     parts = name.split(" ")
     if opts.debug:
-        print(('(debug) "{0}" {1} parts'.format(name, len(parts))))
+        print(('(debug) "{0}" {1} parts'.format(name, len(parts))), file=info)
     if len(parts) == 1:
         return [name.title()]
     elif len(parts) == 2:
@@ -477,7 +982,7 @@ def normalize_author(calibre_author):
             second_sff = ". ".join(initiales)
         nom = parts[-1].title()
         if opts.debug:
-            print(("(debug) prenom={0} nom={1}".format(prenom, nom)))
+            print(("(debug) prenom={0} nom={1}".format(prenom, nom)), file=info)
         if len(parts) == 3:
             if second == second_sff:
                 return [
@@ -562,8 +1067,10 @@ def normalize_authors(calibre_authors):
             # most likely 2 authors
             results = normalize_author(authors[0]) + normalize_author(authors[1])
         else:
-            results = normalize_author(
-                "{1} {0}".format(authors[0].strip(), authors[1].strip())
+            results = list(
+                normalize_author(
+                    "{1} {0}".format(authors[0].strip(), authors[1].strip())
+                )
             )
     else:
         # do we have a clear separator between authors? like ; or & ?
@@ -571,58 +1078,199 @@ def normalize_authors(calibre_authors):
         guesses = [normalize_author(a) for a in authors]
         results = [g for gs in guesses for g in gs]
     if opts.debug:
-        print(('(debug) "{0} [{1}]"'.format(calibre_authors, ", ".join(results))))
+        print(
+            ('(debug) "{0} [{1}]"'.format(calibre_authors, ", ".join(results))),
+            file=info,
+        )
     return results
 
 
-def lookup_match_authors(d_calibre, d_sff, filter):
+class VariantTable:
+    """
+    # normalize_authors of each calibre author, computed once
+    # firsts is the reverse table: first guess -> calibre authors, it
+    # resolves the --author filter without normalizing every author
+    # the table can be saved to json with a fingerprint of the library
+    """
+
+    version = 1
+
+    def __init__(self, authors=()):
+        self.variants = {}
+        self.firsts = {}
+        for author in authors:
+            self.get(author)
+
+    def add(self, author, variants):
+        self.variants[author] = variants
+        if len(variants) > 0:
+            self.firsts.setdefault(variants[0], []).append(author)
+
+    def get(self, author):
+        """variants of *author*"""
+        if author not in self.variants:
+            self.add(author, normalize_authors(author))
+        return self.variants[author]
+
+    def with_first(self, first, authors):
+        """*authors* whose first variant is *first*"""
+        for author in authors:
+            self.get(author)
+        return set(self.firsts.get(first, []))
+
+    @classmethod
+    def fingerprint(cls, authors):
+        h = hashlib.sha256(str(cls.version).encode("utf-8"))
+        for author in sorted(authors):
+            h.update(b"\0")
+            h.update(author.encode("utf-8"))
+        return h.hexdigest()
+
+    def save(self, path, authors):
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "fingerprint": self.fingerprint(authors),
+                    "variants": [[a, self.get(a)] for a in authors],
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path, authors):
+        """table saved for the same *authors* or None"""
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get("fingerprint") != cls.fingerprint(authors):
+            return None
+        table = cls()
+        for author, variants in saved["variants"]:
+            table.add(author, variants)
+        return table
+
+
+def lookup_match_authors(d_calibre, d_sff, filter, index=None, variants=None):
     # per author, compute intersection length between set of possible matches
+    # if an AuthorIndex of d_sff is given, unmatched authors get a fuzzy lookup
     exact_authors = []
     notfound_authors = []
+    if variants is None:
+        variants = VariantTable()
+    if filter is not None:
+        wanted = variants.with_first(filter, d_calibre)
+        d_calibre = [a for a in d_calibre if a in wanted]
     for a in d_calibre:
-        sa = normalize_authors(a)
-        if filter is not None and sa[0] != filter:
-            continue
+        sa = variants.get(a)
         inter = set(sa).intersection(d_sff)
+        fuzzy = None
+        if len(inter) == 0 and index is not None:
+            fuzzy = index.lookup(a)
         if len(inter) > 0:
             sff = inter.intersection(d_sff)
             exact_authors.append({"calibre": a, "sff": sff.pop()})
             if opts.debug:
-                print(("(debug) {0} match {1}".format(a, sa[0])))
+                print(("(debug) {0} match {1}".format(a, sa[0])), file=info)
+        elif fuzzy is not None:
+            exact_authors.append({"calibre": a, "sff": fuzzy})
+            if opts.debug:
+                print(("(debug) {0} fuzzy match {1}".format(a, fuzzy)), file=info)
         else:
             notfound_authors.append(a)
             if opts.debug:
-                print(("(debug) {0} -> {1} doesnt match".format(a, " ".join(sa))))
+                print(
+                    ("(debug) {0} -> {1} doesnt match".format(a, " ".join(sa))),
+                    file=info,
+                )
     return exact_authors, notfound_authors
 
 
 if __name__ == "__main__":
 
     opts = opts_parser.parse_args()
+    # with a machine readable report, informations go to stderr
+    if opts.format != "text":
+        info = sys.stderr
 
     # list of all authors in Calibre
     if opts.calibre:
         dir_calibre = opts.calibre
-    d_calibre = scan_dir(dir_calibre)
+    calibre_source = opts.calibre_source
+    if calibre_source == "db":
+        d_calibre = get_calibre_index().authors()
+    else:
+        d_calibre = scan_dir(dir_calibre)
 
     # list of all authors in SFF
     if opts.sff:
         dir_sffupdate = opts.sff
-    d_sff = set(scan_dir(dir_sffupdate))
+    d_sff = set(get_sff_index().authors())
 
+    author_index = None
+    if opts.fuzzy:
+        author_index = AuthorIndex(d_sff)
+    variants = None
+    if opts.variants:
+        variants = VariantTable.load(opts.variants, d_calibre)
+        if variants is None:
+            variants = VariantTable(d_calibre)
+            variants.save(opts.variants, d_calibre)
     exact_authors, notfound_authors = lookup_match_authors(
-        d_calibre, d_sff, opts.author
+        d_calibre, d_sff, opts.author, author_index, variants
     )
 
+    writer = None
+    if opts.format != "text":
+        writer = report_writers[opts.format]()
+
     print(
         (
             "{0} authors in Calibre, {1} authors in new sff update, found {2} authors in both".format(
                 len(d_calibre), len(d_sff), len(exact_authors)
             )
-        )
+        ),
+        file=info,
     )
     if opts.debug:
-        print(notfound_authors)
+        print(notfound_authors, file=info)
+
+    state = None
+    if opts.state:
+        state = StateStore(opts.state)
 
-    for author in exact_authors:
-        display(author, opts.display)
+    try:
+        for author, status_title in scan_authors(exact_authors, opts.jobs, state):
+            if state is not None:
+                state.record(author["sff"], status_title)
+                if len(status_title) == 0:
+                    continue
+            if writer is not None:
+                writer.write(author, status_title)
+            else:
+                display(author, opts.display, status_title)
+    finally:
+        if writer is not None:
+            writer.close()
+        if state is not None:
+            state.close()
+            print(
+                (
+                    "(state) {0} books already seen, {1} new or changed books".format(
+                        state.known, state.added
+                    )
+                ),
+                file=info,
+            )
+
+    if opts.verbose:
+        listed, saved = get_sff_index().stats()
+        print(
+            (
+                "(sff) {0} directories listed, {1} stat calls saved".format(
+                    listed, saved
+                )
+            ),
+            file=info,
+        )
@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# benchmark for sffchecker
+# generate a synthetic calibre library and a synthetic sff update in a
+# temporary directory, then time each stage of sffchecker separately:
+#    python sffchecker_bench.py --authors 2000 --books 20
+#    python sffchecker_bench.py --profile slowest.prof
+#    python -m pstats slowest.prof
+# Author: P. Aubert pierreaubert@yahoo.fr
+# Apache 2 License
+# ----------------------------------------------------------------------
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import cProfile
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+
+import sffchecker
+
+opts_parser = argparse.ArgumentParser(
+    description="Measure sffchecker on a generated calibre library and sff update."
+)
+opts_parser.add_argument(
+    "-a", "--authors", help="number of authors", type=int, default=500
+)
+opts_parser.add_argument(
+    "-b", "--books", help="number of books per author", type=int, default=10
+)
+opts_parser.add_argument(
+    "--series",
+    help="number of books per serie, 0 for no serie",
+    type=int,
+    default=3,
+)
+opts_parser.add_argument(
+    "--formats",
+    help="formats of each book",
+    nargs="+",
+    default=["epub", "mobi"],
+)
+opts_parser.add_argument(
+    "--overlap",
+    help="part of the sff books already in calibre",
+    type=float,
+    default=0.5,
+)
+opts_parser.add_argument(
+    "-j", "--jobs", help="number of authors scanned in parallel", type=int, default=1
+)
+opts_parser.add_argument(
+    "-s", "--seed", help="seed for the generator", type=int, default=1
+)
+opts_parser.add_argument(
+    "--keep", help="generate the trees in this directory and keep them", action="store"
+)
+opts_parser.add_argument(
+    "--profile", help="write a cProfile dump of the slowest stage", action="store"
+)
+opts_parser.add_argument(
+    "-o", "--output", help="append results to this file (json lines)", action="store"
+)
+opts = None
+
+firstnames = ["Isaac", "Ursula", "Arthur", "Philip", "Frank", "Robert", "Anne", "Jules"]
+middlenames = ["", "", "", "K.", "C.", "Le", "G."]
+words = ["star", "night", "empire", "machine", "river", "stone", "dream", "city"]
+words += ["winter", "ship", "garden", "storm", "mirror", "tower", "shadow", "fire"]
+
+
+def author_name(rnd, i):
+    name = rnd.choice(firstnames)
+    middle = rnd.choice(middlenames)
+    if middle:
+        name = "{0} {1}".format(name, middle)
+    return "{0} {1}{2}".format(name, rnd.choice(words).title(), i)
+
+
+def title_name(rnd, i):
+    return "{0} {1} {2}".format(rnd.choice(words), rnd.choice(words), i).title()
+
+
+def touch(path):
+    with open(path, "w"):
+        pass
+
+
+def generate(
+    root, authors=500, books=10, series=3, formats=("epub", "mobi"), overlap=0.5, seed=1
+):
+    """
+    build root/calibre and root/sff
+    calibre: author/title (id)/title - author.fmt
+    sff:     author - serie n - title.fmt or author - title.fmt
+    return (calibre, sff) paths
+    """
+    rnd = random.Random(seed)
+    calibre = os.path.join(root, "calibre")
+    sff = os.path.join(root, "sff")
+    os.makedirs(calibre)
+    os.makedirs(sff)
+    book_id = 0
+    for i in range(authors):
+        author = author_name(rnd, i)
+        os.makedirs(os.path.join(sff, author))
+        for j in range(books):
+            title = title_name(rnd, j)
+            if series > 0:
+                serie = "{0} {1}".format(rnd.choice(words).title(), j // series)
+                name = "{0} - {1} {2} - {3}".format(author, serie, j % series + 1, title)
+            else:
+                name = "{0} - {1}".format(author, title)
+            for fmt in formats:
+                touch(os.path.join(sff, author, "{0}.{1}".format(name, fmt)))
+            if rnd.random() < overlap:
+                book_id += 1
+                book_dir = os.path.join(
+                    calibre, author, "{0} ({1})".format(title, book_id)
+                )
+                os.makedirs(book_dir)
+                for fmt in formats:
+                    book = "{0} - {1}.{2}".format(title, author, fmt)
+                    touch(os.path.join(book_dir, book))
+    return calibre, sff
+
+
+class SyscallCounter:
+    """count calls to os.scandir, os.listdir, os.stat and os.lstat"""
+
+    names = ["scandir", "listdir", "stat", "lstat"]
+
+    def __init__(self):
+        self.counts = dict((n, 0) for n in self.names)
+        self.saved = {}
+
+    def wrap(self, name):
+        f = getattr(os, name)
+
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return f(*args, **kwargs)
+
+        return counted
+
+    def __enter__(self):
+        for name in self.names:
+            self.saved[name] = getattr(os, name)
+            setattr(os, name, self.wrap(name))
+        return self
+
+    def __exit__(self, *args):
+        for name, f in self.saved.items():
+            setattr(os, name, f)
+
+
+class Stages:
+    """stages of a sffchecker run, each one reuses the results of the previous ones"""
+
+    def __init__(self, calibre, sff, jobs=1):
+        self.calibre = calibre
+        self.sff = sff
+        self.jobs = jobs
+        sffchecker.opts = sffchecker.opts_parser.parse_args([])
+        sffchecker.dir_calibre = calibre
+        sffchecker.dir_sffupdate = sff
+
+    def scan_dir(self):
+        self.d_calibre = sffchecker.scan_dir(self.calibre)
+
+    def calibre_index(self):
+        sffchecker.calibre_index = None
+        sffchecker.get_calibre_index()
+
+    def sff_index(self):
+        sffchecker.sff_index = None
+        self.d_sff = set(sffchecker.get_sff_index().authors())
+
+    def lookup_match_authors(self):
+        self.exact, self.notfound = sffchecker.lookup_match_authors(
+            self.d_calibre, self.d_sff, None
+        )
+
+    def scan(self):
+        # books are listed by the first scan, start from a fresh index
+        sffchecker.sff_index = None
+        sffchecker.get_sff_index()
+        self.results = list(sffchecker.scan_authors(self.exact, self.jobs))
+
+    def display(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for author, status_title in self.results:
+                sffchecker.display(author, "grouped", status_title)
+
+    order = [
+        "scan_dir",
+        "calibre_index",
+        "sff_index",
+        "lookup_match_authors",
+        "scan",
+        "display",
+    ]
+
+
+def measure(f):
+    """time, syscalls and peak memory of f()"""
+    with SyscallCounter() as counter:
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    f()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"time": elapsed, "syscalls": counter.counts, "peak_memory": peak}
+
+
+def commit():
+    """current git commit or None"""
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+            or None
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench(calibre, sff, jobs=1, profile=None):
+    """run all stages, return the results and profile the slowest one"""
+    stages = Stages(calibre, sff, jobs)
+    results = {}
+    for name in Stages.order:
+        results[name] = measure(getattr(stages, name))
+    if profile:
+        slowest = max(results, key=lambda n: results[n]["time"])
+        profiler = cProfile.Profile()
+        profiler.runcall(getattr(stages, slowest))
+        profiler.dump_stats(profile)
+        print(("profile of {0} written to {1}".format(slowest, profile)))
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "calibre_authors": len(stages.d_calibre),
+        "sff_authors": len(stages.d_sff),
+        "matched": len(stages.exact),
+        "books": sum(len(r[1]) for r in stages.results),
+        "jobs": jobs,
+        "stages": results,
+    }
+
+
+def display(result):
+    print(
+        (
+            "sffchecker: {0} calibre authors, {1} sff authors, {2} matched, {3} books".format(
+                result["calibre_authors"],
+                result["sff_authors"],
+                result["matched"],
+                result["books"],
+            )
+        )
+    )
+    for name in Stages.order:
+        stage = result["stages"][name]
+        print(
+            (
+                "    {0:<22s} {1:8.3f}s {2:>8d} syscalls {3:8.1f} MiB".format(
+                    name,
+                    stage["time"],
+                    sum(stage["syscalls"].values()),
+                    stage["peak_memory"] / (1024 * 1024),
+                )
+            )
+        )
+
+
+# main
+if __name__ == "__main__":
+
+    opts = opts_parser.parse_args()
+
+    root = opts.keep
+    if root is None:
+        root = tempfile.mkdtemp(prefix="sffchecker_bench")
+    try:
+        calibre, sff = generate(
+            root,
+            opts.authors,
+            opts.books,
+            opts.series,
+            opts.formats,
+            opts.overlap,
+            opts.seed,
+        )
+        result = bench(calibre, sff, opts.jobs, opts.profile)
+    finally:
+        if opts.keep is None:
+            shutil.rmtree(root)
+
+    display(result)
+    if opts.output:
+        with open(opts.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+    sys.exit(0)
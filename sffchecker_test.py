@@ -1,3 +1,9 @@
+import io
+import os
+import csv
+import json
+import sqlite3
+import tempfile
 import unittest
 import sffchecker
 from sffchecker import (
@@ -10,6 +16,17 @@ from sffchecker import (
     grab_last_number,
     lookup_match_authors,
     scan_dir,
+    CalibreIndex,
+    check,
+    scan_authors,
+    SFFIndex,
+    AuthorIndex,
+    match_authors,
+    VariantTable,
+    StateStore,
+    report_writers,
+    parse_sff_book,
+    SFFBook,
 )
 
 
@@ -305,5 +322,349 @@ class CheckOnGoldDatas(SFFCheckerTest):
         self.assertEqual(len(notfound), 0)
 
 
+class CalibreIndexTest(SFFCheckerTest):
+    def setUp(self):
+        super(CalibreIndexTest, self).setUp()
+        self.index = CalibreIndex("./tests/t1/calibre")
+        self.author = {"calibre": "Paul Schwytz", "sff": "Paul Schwytz"}
+
+    def test_titles(self):
+        self.assertEqual(
+            self.index.lookup("Paul Schwytz"),
+            set(["fun book", "not so fun book", "paul schwytz"]),
+        )
+
+    def test_substring(self):
+        self.assertEqual(self.index.lookup("Schwytz"), self.index.lookup("Paul Schwytz"))
+        self.assertEqual(self.index.lookup("Nobody"), set())
+
+    def test_check(self):
+        self.assertFalse(
+            check(self.author, "Paul Schwytz - Fun Book.epub", self.index)
+        )
+        self.assertFalse(
+            check(self.author, "Paul Schwytz - Not So Fun Book # v2.epub", self.index)
+        )
+        self.assertTrue(
+            check(self.author, "Paul Schwytz - Serious Book.epub", self.index)
+        )
+
+    def test_missing_root(self):
+        self.assertEqual(CalibreIndex("./tests/t1/nowhere").authors(), [])
+
+
+class CalibreDatabaseTest(SFFCheckerTest):
+    def setUp(self):
+        super(CalibreDatabaseTest, self).setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        conn = sqlite3.connect(os.path.join(self.tmp.name, "metadata.db"))
+        conn.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, path TEXT)")
+        conn.execute(
+            "CREATE TABLE data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT, name TEXT)"
+        )
+        conn.executemany(
+            "INSERT INTO books VALUES (?, ?, ?)",
+            [
+                (1, "Fun Book", "Paul Schwytz/Fun Book (1)"),
+                (2, "Not So Fun Book", "Paul Schwytz/Not So Fun Book (2)"),
+                (3, "Empty", "Nobody/Empty (3)"),
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO data VALUES (?, ?, ?, ?)",
+            [
+                (1, 1, "EPUB", "Fun Book - Paul Schwytz"),
+                (2, 1, "MOBI", "Fun Book - Paul Schwytz"),
+                (3, 2, "MOBI", "Not So Fun Book - Paul Schwytz"),
+            ],
+        )
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_as_files(self):
+        db = CalibreIndex(self.tmp.name, "db")
+        fs = CalibreIndex("./tests/t1/calibre", "fs")
+        self.assertEqual(db.lookup("Paul Schwytz"), fs.lookup("Paul Schwytz"))
+        self.assertEqual(sorted(db.authors()), ["Nobody", "Paul Schwytz"])
+        self.assertEqual(db.lookup("Nobody"), set())
+
+    def test_fallback(self):
+        index = CalibreIndex("./tests/t1/calibre", "db")
+        self.assertEqual(index.authors(), scan_dir("./tests/t1/calibre"))
+        self.assertIn("fun book", index.lookup("Paul Schwytz"))
+
+
+class ScanAuthorsTest(SFFCheckerTest):
+    def setUp(self):
+        super(ScanAuthorsTest, self).setUp()
+        self.saved = (sffchecker.dir_calibre, sffchecker.dir_sffupdate)
+        sffchecker.dir_calibre = "./tests/t1/calibre"
+        sffchecker.dir_sffupdate = "./tests/t1/sff"
+        self.authors = [{"calibre": "Paul Schwytz", "sff": "Paul Schwytz"}] * 5
+
+    def tearDown(self):
+        sffchecker.dir_calibre, sffchecker.dir_sffupdate = self.saved
+
+    def test_jobs(self):
+        serial = list(scan_authors(self.authors, 1))
+        parallel = list(scan_authors(self.authors, 3))
+        self.assertEqual(len(serial), 5)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(
+            sorted(serial[0][1]),
+            [
+                [False, "Paul Schwytz - Fun Book.epub"],
+                [False, "Paul Schwytz - Not So Fun Book.epub"],
+            ],
+        )
+
+    def test_no_authors(self):
+        sffchecker.calibre_index = None
+        sffchecker.sff_index = None
+        self.assertEqual(list(scan_authors([], 2)), [])
+        self.assertIsNone(sffchecker.calibre_index)
+        self.assertIsNone(sffchecker.sff_index)
+
+
+class SFFIndexTest(SFFCheckerTest):
+    def setUp(self):
+        super(SFFIndexTest, self).setUp()
+        self.index = SFFIndex("./tests/t1/sff")
+
+    def test_authors(self):
+        self.assertEqual(self.index.authors(), scan_dir("./tests/t1/sff"))
+
+    def test_books(self):
+        self.assertEqual(
+            sorted(self.index.list_books("Paul Schwytz ")),
+            ["Paul Schwytz - Fun Book.epub", "Paul Schwytz - Not So Fun Book.epub"],
+        )
+        self.assertIsNone(self.index.list_books("Nobody"))
+
+    def test_stats(self):
+        self.assertEqual(self.index.stats(), (1, 1))
+        self.index.list_books("Paul Schwytz")
+        self.index.list_books("Paul Schwytz")
+        self.assertEqual(self.index.stats(), (2, 4))
+
+    def test_missing_root(self):
+        index = SFFIndex("./tests/t1/nowhere")
+        self.assertEqual(index.authors(), [])
+        self.assertIsNone(index.list_books("Paul Schwytz"))
+
+
+class FuzzyAuthorMatcher(SFFCheckerTest):
+    def setUp(self):
+        super(FuzzyAuthorMatcher, self).setUp()
+        self.sff = [
+            "A. G. Riddle",
+            "Jules Barbey d'Aurevilly",
+            "Simon Googwill",
+            "Isaac Asimov",
+            "Ian Asimov",
+        ]
+        self.index = AuthorIndex(self.sff)
+
+    def test_match_authors(self):
+        self.assertTrue(match_authors("A.G. Riddle", "A. G. Riddle"))
+        self.assertTrue(match_authors("Arthur G. Riddle", "A. G. Riddle"))
+        self.assertTrue(
+            match_authors("Jules Amedee Barbey d'Aurevilly", "Jules Barbey d'Aurevilly")
+        )
+        self.assertTrue(
+            match_authors("Jules Amedee Barbey d'Aurevilly", "J.A. Barbey d'Aurevilly")
+        )
+        self.assertTrue(match_authors("GOOGWILL, simon", "Simon Googwill"))
+        self.assertFalse(match_authors("Isaac Asimov", "Ian Asimov"))
+        self.assertFalse(match_authors("Asimov", "Isaac Asimov"))
+
+    def test_candidates(self):
+        self.assertEqual(self.index.candidates("Isaac Asimov"), ["Isaac Asimov", "Ian Asimov"])
+        self.assertEqual(self.index.candidates("Paul Schwytz"), [])
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup("Arthur G. Riddle"), "A. G. Riddle")
+        self.assertEqual(
+            self.index.lookup("Jules Amedee Barbey d'Aurevilly"),
+            "Jules Barbey d'Aurevilly",
+        )
+        self.assertEqual(self.index.lookup("Googwill Simon"), "Simon Googwill")
+        self.assertEqual(self.index.lookup("Nobody; I. Asimov"), None)
+        self.assertEqual(self.index.lookup("Nobody; Isaac Asimov"), "Isaac Asimov")
+        self.assertIsNone(self.index.lookup("Paul Schwytz"))
+
+    def test_lookup_match_authors(self):
+        calibre = ["Jules Amedee Barbey d'Aurevilly", "Paul Schwytz"]
+        exact, notfound = lookup_match_authors(calibre, set(self.sff), None)
+        self.assertEqual(len(exact), 0)
+        exact, notfound = lookup_match_authors(calibre, set(self.sff), None, self.index)
+        self.assertEqual(
+            exact,
+            [
+                {
+                    "calibre": "Jules Amedee Barbey d'Aurevilly",
+                    "sff": "Jules Barbey d'Aurevilly",
+                }
+            ],
+        )
+        self.assertEqual(notfound, ["Paul Schwytz"])
+
+
+class VariantTableTest(SFFCheckerTest):
+    def setUp(self):
+        super(VariantTableTest, self).setUp()
+        self.authors = ["Simon GOOGWILL", "A.G. Riddle", "Adolfo Bioy Casares"]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "variants.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_as_normalize(self):
+        table = VariantTable(self.authors)
+        for a in self.authors:
+            self.assertEqual(table.get(a), normalize_authors(a))
+
+    def test_with_first(self):
+        table = VariantTable()
+        self.assertEqual(table.with_first("Simon Googwill", self.authors), set(["Simon GOOGWILL"]))
+        self.assertEqual(table.with_first("Nobody", self.authors), set())
+
+    def test_persist(self):
+        VariantTable(self.authors).save(self.path, self.authors)
+        table = VariantTable.load(self.path, self.authors)
+        self.assertIsNotNone(table)
+        self.assertEqual(table.variants, VariantTable(self.authors).variants)
+        self.assertIsNone(VariantTable.load(self.path, self.authors[1:]))
+        self.assertIsNone(VariantTable.load(self.path + ".missing", self.authors))
+
+    def test_filter(self):
+        sff = set(["A. G. Riddle", "Simon Googwill"])
+        table = VariantTable(self.authors)
+        exact, notfound = lookup_match_authors(self.authors, sff, "Simon Googwill", None, table)
+        self.assertEqual(exact, [{"calibre": "Simon GOOGWILL", "sff": "Simon Googwill"}])
+        self.assertEqual(notfound, [])
+
+
+class StateStoreTest(ScanAuthorsTest):
+    def setUp(self):
+        super(StateStoreTest, self).setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "state.db")
+
+    def tearDown(self):
+        super(StateStoreTest, self).tearDown()
+        self.tmp.cleanup()
+
+    def run_once(self, jobs=1):
+        state = StateStore(self.path)
+        books = []
+        for author, status_title in scan_authors(self.authors[0:1], jobs, state):
+            state.record(author["sff"], status_title)
+            books += status_title
+        state.close()
+        return state, books
+
+    def test_incremental(self):
+        state, books = self.run_once()
+        self.assertEqual((state.known, state.added, len(books)), (0, 2, 2))
+        state, books = self.run_once(2)
+        self.assertEqual((state.known, state.added, books), (2, 0, []))
+
+    def test_new_book(self):
+        self.run_once()
+        state = StateStore(self.path)
+        state.conn.execute("DELETE FROM books WHERE name LIKE '%Not So%'")
+        state.close()
+        state, books = self.run_once()
+        self.assertEqual(books, [[False, "Paul Schwytz - Not So Fun Book.epub"]])
+
+    def test_status_changed(self):
+        self.run_once()
+        state = StateStore(self.path)
+        state.conn.execute("UPDATE books SET status = 1 WHERE name LIKE '%Not So%'")
+        state.close()
+        state, books = self.run_once()
+        self.assertEqual((state.known, state.added), (2, 1))
+        self.assertEqual(books, [[False, "Paul Schwytz - Not So Fun Book.epub"]])
+        # reported once, then the new status is stored
+        state, books = self.run_once()
+        self.assertEqual(books, [])
+
+
+class ReportWriterTest(SFFCheckerTest):
+    def setUp(self):
+        super(ReportWriterTest, self).setUp()
+        self.author = {"calibre": "author", "sff": "author"}
+        self.status_title = [
+            [True, "author - collection 01 - title1 # (v1.0).epub"],
+            [False, "author - collection 02 - title2 # (v1.1).epub"],
+        ]
+
+    def report(self, format, count=1):
+        out = io.StringIO()
+        writer = report_writers[format](out, bufsize=1)
+        for _ in range(count):
+            writer.write(self.author, self.status_title)
+        writer.close()
+        return out.getvalue()
+
+    def test_json(self):
+        records = json.loads(self.report("json", 2))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]["author"], "author")
+        self.assertEqual(records[0]["books"][1], {"status": False, "file": self.status_title[1][1]})
+        self.assertEqual(records[0]["collections"][0]["collection"], "collection")
+        self.assertEqual(json.loads(self.report("json", 0)), [])
+
+    def test_jsonl(self):
+        lines = self.report("jsonl", 2).splitlines()
+        self.assertEqual(len(lines), 2)
+        titles = json.loads(lines[1])["collections"][0]["titles"]
+        self.assertEqual([t["title"] for t in titles], ["title1", "title2"])
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.report("csv"))))
+        self.assertEqual(rows[0][0:3], ["author", "calibre", "collection"])
+        self.assertEqual(
+            rows[1],
+            ["author", "author", "collection", "01", "title1", "epub", "(v1.0)", "NEW"],
+        )
+        self.assertEqual(rows[2][-1], "UPD")
+        self.assertEqual(len(rows), 3)
+
+
+class ParseSFFBook(SFFCheckerTest):
+    def test_book(self):
+        self.assertEqual(
+            parse_sff_book("Author - Title1.epub"),
+            SFFBook("Author", "__none__", None, "Title1", None, "epub"),
+        )
+
+    def test_serie(self):
+        self.assertEqual(
+            parse_sff_book("author - collection 02 - title2 # (v1.1).epub"),
+            SFFBook("author", "collection", "02", "title2", "(v1.1)", "epub"),
+        )
+        self.assertEqual(
+            parse_sff_book("Author - Collection - 2 - Title2.mobi"),
+            SFFBook("Author", "Collection", "2", "Title2", None, "mobi"),
+        )
+
+    def test_all_books_without_collection(self):
+        status_title = [
+            [True, "Author - Title1.epub"],
+            [False, "Author - Title2.epub"],
+            [True, "Author - Title2.mobi"],
+        ]
+        titles = group_by_collection(status_title)[0]["titles"]
+        self.assertEqual([t["title"] for t in titles], ["Title1", "Title2"])
+        self.assertEqual(titles[1]["suffix"], ["epub", "mobi"])
+        self.assertEqual(titles[1]["status"], False)
+
+
 if __name__ == "__main__":
     unittest.main()